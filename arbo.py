@@ -2,15 +2,26 @@
 # vim: set fileencoding=utf-8 sw=2 ts=2 et :
 from __future__ import absolute_import
 
+import array
 import codecs
+import collections
+import concurrent.futures
+import functools
+import heapq
 import itertools
 import locale
 import argparse
+import mmap
+import multiprocessing
 import os
 import re
+import stat
 import subprocess
 import sys
+import tempfile
 from arbo_readline0 import readline0
+import arbo_lscolors
+import arbo_sources
 
 # Used for filesystem root and POSIX alternative root
 # Path components otherwise never contain slashes
@@ -23,7 +34,7 @@ SPECIALS = (SLASH, SLASHSLASH)
 # Output is escaped so the only escapes and newlines are the ones ls adds.
 START_COLOR = '\033'
 WITH_COLOR_RE = re.compile(
-  r'^(?:\033\[0m)?(\033\[(?:[0-9]+;){1,2}[0-9]+m)?[^\n\033]*?([^/\n\033]*/*)(?:\033\[(?:0m|K))*\n(?:\033\[m)?$')
+  r'^(?:\033\[0m)?(\033\[[0-9;]*m)?[^\n\033]*?([^/\n\033]*/*)(?:\033\[(?:0m|K))*\n(?:\033\[m)?$')
 END_COLOR = '\033[0m'
 END_LS = '\033[m'
 
@@ -46,6 +57,28 @@ DEFAULT_WIDE_STYLE = WIDE_STYLES['unicode']
 # How many paths in one ls call
 BULK_LS_COUNT = 400
 
+# How many ls calls may run at once, with --run-ls;
+# even on one core, two overlap ls with our own work
+LS_PROCESS_COUNT = max(2, os.cpu_count() or 1)
+
+# How much input to read at once
+INPUT_BLOCK_SIZE = 1 << 16
+
+# How much of a memory-mapped input to decode at once
+MMAP_CHUNK_SIZE = 1 << 20
+
+# How much output to collect before writing it out
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# How CompactTree stores names in its arena
+ARENA_ENCODING = 'utf-8'
+
+# How much memory sorted_line_iter may use before spilling runs to disk
+DEFAULT_SORT_MEMORY = 256 << 20
+# How sorted_line_iter writes the runs it spills
+SPILL_ENCODING = 'utf-8'
+SIZE_SUFFIXES = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, }
+
 
 class Node(object):
   """
@@ -53,18 +86,45 @@ class Node(object):
 
   Children is an iterable.
   Value is a path element.
+  Note is shown after the value, eg the package owning a file.
   """
 
+  __slots__ = ('value', 'color', 'children', 'index', 'note', )
+
   def __init__(self, value):
     self.value = value
     self.color = None
     self.children = []
+    self.note = None
+    # Maps child values to children; only built when merging unsorted input
+    self.index = None
+
+  def child_index(self):
+    """
+    Return the value to child mapping, building it on first use.
+    """
+
+    if self.index is None:
+      self.index = dict((child.value, child) for child in self.children)
+    return self.index
+
+  @property
+  def has_children(self):
+    return bool(self.children)
+
+  @property
+  def has_single_child(self):
+    return len(self.children) == 1
 
   @property
   def pvalue(self):
     if self.color is not None:
-      return self.color + self.value + END_COLOR
-    return self.value
+      pvalue = self.color + self.value + END_COLOR
+    else:
+      pvalue = self.value
+    if self.note is not None:
+      pvalue += ' [%s]' % self.note
+    return pvalue
 
   def traverse_skip_root(self):
     root_cursor = NodeTraversal(self, None, True, True)
@@ -75,19 +135,31 @@ class Node(object):
 
 
 class NodeTraversal(object):
+  """
+  A node seen from a traversal, with its place among its ancestors.
+
+  Depth is set on creation (root has depth 0),
+  and path_str is cached, so neither walks up the parents.
+  """
+
+  __slots__ = (
+      'node', 'parent', 'is_first_sib', 'is_last_sib', 'depth', '_path_str', )
+
   def __init__(self, node, parent, is_first_sib, is_last_sib):
     self.node = node
     self.parent = parent
     self.is_first_sib = is_first_sib
     self.is_last_sib = is_last_sib
+    self.depth = 0 if parent is None else parent.depth + 1
+    self._path_str = None
 
   @property
   def has_single_child(self):
-    return len(self.node.children) == 1
+    return self.node.has_single_child
 
   @property
   def has_children(self):
-    return bool(self.node.children)
+    return self.node.has_children
 
   @property
   def is_single_child(self):
@@ -98,34 +170,31 @@ class NodeTraversal(object):
 
   @property
   def path_str(self):
-    # Don't use the ROOT node in a path.
-    if self.min_depth(2):
-      r = self.parent.path_str
-      if self.parent not in SPECIALS:
-        r += '/'
-    else:
-      r = ''
-    r += self.node.value
-    return r
-
-  def min_depth(self, n):
-    if n < 0:
-      raise ValueError(n, 'must be non-negative')
-    if n == 0:
-      return True
-    # root has depth 0
-    if self.is_root:
-      return False
-    return self.parent.min_depth(n - 1)
-
-  def iter_parents(self, min_depth):
-    # XXX there's probably a way to avoid this loop entirely
-    a = self.parent
-    rev_list = []
-    while a is not None and a.min_depth(min_depth):
-      rev_list.insert(0, a)
-      a = a.parent
-    return rev_list
+    """
+    The path to the node, as values stood when it was first asked for.
+
+    Colorizing replaces values with quoted ones,
+    which must not leak into the paths of descendants.
+    """
+
+    if self._path_str is None:
+      # Fill in uncomputed ancestors from the top, without recursing
+      todo = []
+      nt = self
+      while nt._path_str is None:
+        todo.append(nt)
+        nt = nt.parent
+        if nt is None:
+          break
+      for nt in reversed(todo):
+        # Don't use the ROOT node in a path.
+        if nt.depth < 2:
+          nt._path_str = nt.node.value
+        elif nt.parent._path_str in SPECIALS:
+          nt._path_str = nt.parent._path_str + nt.node.value
+        else:
+          nt._path_str = nt.parent._path_str + '/' + nt.node.value
+    return self._path_str
 
   def iter_with_first_last(self):
     el0 = None
@@ -139,26 +208,231 @@ class NodeTraversal(object):
       yield NodeTraversal(el0, self, is_first, True)
 
   def traverse_depth_first(self):
+    """
+    Yield this traversal and those of all descendants, in preorder.
+
+    Keeps a stack of sibling iterators instead of recursing,
+    so any depth works and each node is yielded through one frame.
+    """
+
     yield self
 
-    for nt in self.iter_with_first_last():
-      for e in nt.traverse_depth_first():
-        yield e
+    stack = [self.iter_with_first_last()]
+    while stack:
+      nt = next(stack[-1], None)
+      if nt is None:
+        stack.pop()
+      else:
+        yield nt
+        stack.append(nt.iter_with_first_last())
+
+
+class CompactTree(object):
+  """
+  A tree kept in typed arrays instead of Node objects.
+
+  Nodes are indices; 0 is ROOT, and NO_NODE marks a missing link.
+  Names are encoded into a single arena, the name of node i
+  is arena[offsets[i]:offsets[i + 1]].
+  Grafts map leaves to (tree, idx) nodes of other trees, which stand in
+  for them; tree_from_line_iter_parallel attaches subtrees that way.
+  """
+
+  NO_NODE = -1
+
+  def __init__(self):
+    self.parents = array.array('i', [self.NO_NODE])
+    self.first_children = array.array('i', [self.NO_NODE])
+    self.next_sibs = array.array('i', [self.NO_NODE])
+    self.last_children = array.array('i', [self.NO_NODE])
+    self.arena = bytearray(b'ROOT')
+    self.offsets = array.array('q', [0, len(self.arena)])
+    self.root = 0
+    # Maps parents to {value: child}; only built when merging unsorted input
+    self.indexes = {}
+    self.grafts = {}
+
+  def value(self, idx):
+    return self.arena[self.offsets[idx]:self.offsets[idx + 1]].decode(
+        ARENA_ENCODING, 'surrogateescape')
+
+  def add_child(self, parent, value):
+    idx = len(self.parents)
+    self.parents.append(parent)
+    self.first_children.append(self.NO_NODE)
+    self.next_sibs.append(self.NO_NODE)
+    self.last_children.append(self.NO_NODE)
+    last = self.last_children[parent]
+    if last == self.NO_NODE:
+      self.first_children[parent] = idx
+    else:
+      self.next_sibs[last] = idx
+    self.last_children[parent] = idx
+    self.arena += value.encode(ARENA_ENCODING, 'surrogateescape')
+    self.offsets.append(len(self.arena))
+    return idx
+
+  def iter_children(self, idx):
+    child = self.first_children[idx]
+    while child != self.NO_NODE:
+      yield child
+      child = self.next_sibs[child]
+
+  def child_index(self, idx):
+    """
+    Return the value to child mapping of a node, building it on first use.
+    """
+
+    index = self.indexes.get(idx)
+    if index is None:
+      index = self.indexes[idx] = dict(
+          (self.value(child), child) for child in self.iter_children(idx))
+    return index
+
+  def traverse_skip_root(self):
+    return CompactNode(self, self.root).traverse_skip_root()
+
+
+class CompactNode(object):
+  """
+  A Node-like view of one CompactTree node, made during traversals.
+
+  Children are views as well, created on each access
+  so that traversals don't keep the whole tree alive as objects.
+  """
+
+  __slots__ = ('tree', 'idx', 'value', 'color', )
+
+  # CompactTree doesn't store notes
+  note = None
+
+  def __init__(self, tree, idx):
+    self.tree = tree
+    self.idx = idx
+    self.value = tree.value(idx)
+    self.color = None
+
+  @property
+  def children(self):
+    tree = self.tree
+    if tree.grafts:
+      grafts = tree.grafts
+      return [
+          CompactNode(*grafts[child]) if child in grafts
+          else CompactNode(tree, child)
+          for child in tree.iter_children(self.idx)]
+    return [CompactNode(tree, child) for child in tree.iter_children(self.idx)]
+
+  # Answered from the links, without making views of the children
+  @property
+  def has_children(self):
+    return self.tree.first_children[self.idx] != CompactTree.NO_NODE
+
+  @property
+  def has_single_child(self):
+    tree = self.tree
+    child = tree.first_children[self.idx]
+    return child != CompactTree.NO_NODE and \
+        tree.next_sibs[child] == CompactTree.NO_NODE
+
+  pvalue = Node.pvalue
+  traverse_skip_root = Node.traverse_skip_root
+
+
+class ByteWriter(object):
+  """
+  Collect encoded output, and write it to a file descriptor in big chunks.
+
+  Display functions write bytes, encoded with self.encoding.
+  A bufsize of 0 writes every line as it comes, for terminals.
+  """
+
+  def __init__(self, fd, encoding, bufsize=OUTPUT_BUFFER_SIZE):
+    self.fd = fd
+    self.encoding = encoding
+    self.bufsize = bufsize
+    self.buf = bytearray()
+
+  def encode(self, text):
+    return text.encode(self.encoding, 'surrogateescape')
+
+  def encode_style(self, style):
+    return tuple(self.encode(glyph) for glyph in style)
+
+  def write(self, data):
+    self.buf += data
+    if len(self.buf) >= self.bufsize:
+      self.flush()
 
+  def flush(self):
+    view = memoryview(self.buf)
+    try:
+      while view:
+        view = view[os.write(self.fd, view):]
+    finally:
+      view.release()
+    del self.buf[:]
 
-def colorize_nt_iter(itr):
+
+def colorize_nt_iter(itr, processes=LS_PROCESS_COUNT):
+  """
+  Colorize traversals with ls, in batches of BULK_LS_COUNT.
+
+  Up to processes ls run at once: while the oldest batch is being read
+  and yielded, the next ones are collected and their ls started.
+  Batches are yielded in order.
+  """
+
+  running = collections.deque()
   while True:
     nt_bulk = list(itertools.islice(itr, BULK_LS_COUNT))
-    if not nt_bulk:
+    if nt_bulk:
+      # Paths are computed now, before earlier batches quote their values
+      running.append((nt_bulk, start_postprocess(nt_bulk)))
+      if len(running) < processes:
+        continue
+    if not running:
       return
-    postprocess_path(nt_bulk)
+    nt_bulk, state = running.popleft()
+    finish_postprocess(*state)
     for nt in nt_bulk:
       yield nt
 
-def display_tree(tree_root, out, wide, colorize):
+def colorize_nt_iter_lstat(itr, ls_colors, encoding, locale_encoding=None):
+  """
+  Colorize and quote nodes like ls does, without running it.
+
+  Files are classified from lstat by ls_colors, an arbo_lscolors.LsColors.
+  """
+
+  for nt in itr:
+    node = nt.node
+    node.color = ls_colors.path_color(nt.path_str, node.value)
+    node.value = arbo_lscolors.quote_escape(
+        node.value, encoding, locale_encoding)
+    yield nt
+
+def colorize_nt_iter_by_mode(itr, modes, ls_colors, encoding,
+    locale_encoding=None):
+  """
+  Colorize and quote nodes from known git modes, without looking at files.
+
+  modes maps paths to modes; paths without one are directories.
+  """
+
+  for nt in itr:
+    node = nt.node
+    # Ask for the path before the value is quoted
+    mode = modes.get(nt.path_str)
+    node.color = ls_colors.git_mode_color(node.value, mode, nt.has_children)
+    node.value = arbo_lscolors.quote_escape(
+        node.value, encoding, locale_encoding)
+    yield nt
+
+def display_tree(tree_root, out, wide, colorize, colorizer=colorize_nt_iter):
   nt_iter = tree_root.traverse_skip_root()
   if colorize:
-    nt_iter = colorize_nt_iter(nt_iter)
+    nt_iter = colorizer(nt_iter)
   else:
     # XXX We should do quoting / escaping here, if ls wasn't invoked.
     pass
@@ -167,73 +441,247 @@ def display_tree(tree_root, out, wide, colorize):
   else:
     display_tree_narrow(tree_root, out, nt_iter)
 
+def display_stream(line_iter, out, skip_dot, colorize,
+    colorizer=colorize_nt_iter):
+  """
+  Display DFS-ordered paths as they are read, without building a tree.
+  """
+
+  nt_iter = stream_traversals(line_iter, skip_dot)
+  if colorize:
+    nt_iter = colorizer(nt_iter)
+  display_tree_narrow(None, out, nt_iter)
+
 def display_tree_narrow(tree_root, out, nt_iter, style=DEFAULT_STYLE):
   """
   Display an ASCII tree from a tree object.
+
+  The indentation contributed by each ancestor is kept on a stack,
+  truncated to the current depth, so each line is joined and written once.
+  out is a ByteWriter.
   """
 
+  style = out.encode_style(style)
+  encode = out.encode
+  # Indentation below each ancestor, from depth 2
+  prefix = []
+  parts = []
   for nt in nt_iter:
-    if not nt.is_single_child and nt.min_depth(2):
-      for nt1 in nt.iter_parents(min_depth=2):
-        if nt1.is_last_sib:
-          out.write(style[0])
+    depth = nt.depth
+    if depth >= 2:
+      del prefix[depth - 2:]
+      if not nt.is_single_child:
+        parts.extend(prefix)
+        if nt.is_last_sib:
+          parts.append(style[2])
         else:
-          out.write(style[1])
+          parts.append(style[3])
       if nt.is_last_sib:
-        out.write(style[2])
+        prefix.append(style[0])
       else:
-        out.write(style[3])
+        prefix.append(style[1])
     # May need quoting / escaping (already done if --color was used)
-    out.write(nt.node.pvalue)
+    parts.append(encode(nt.node.pvalue))
     if not nt.has_single_child:
-      out.write('\n')
+      parts.append(b'\n')
+      out.write(b''.join(parts))
+      del parts[:]
     else:
       if nt.node.value not in SPECIALS:
-        out.write('/')
+        parts.append(b'/')
 
 def display_tree_wide(tree_root, out, nt_iter, style=DEFAULT_WIDE_STYLE):
   """
   Display an ASCII tree from a tree object.
 
   Less vertical space, more horizontal space, like pstree.
+  Indentation is kept on a stack, like in display_tree_narrow.
   """
 
+  style = out.encode_style(style)
+  encode = out.encode
+  # Indentation below each ancestor, from depth 1
+  prefix = []
+  parts = []
   for nt in nt_iter:
-    if nt.min_depth(2):
+    depth = nt.depth
+    del prefix[depth - 1:]
+    if depth >= 2:
       if nt.is_first_sib:
         if nt.is_last_sib:
-          out.write(style[1])
+          parts.append(style[1])
         else:
-          out.write(style[2])
+          parts.append(style[2])
       else:
-        first = True
-        for nt1 in nt.iter_parents(min_depth=1):
-          if not first:
-            if nt1.is_last_sib:
-              out.write(style[0])
-            else:
-              out.write(style[4])
-          first = False
-          out.write(' ' * len(nt1.node.value))
+        parts.extend(prefix)
         if nt.is_last_sib:
-          out.write(style[3])
+          parts.append(style[3])
         else:
-          out.write(style[5])
+          parts.append(style[5])
+      if nt.is_last_sib:
+        prefix.append(style[0] + b' ' * len(nt.node.value))
+      else:
+        prefix.append(style[4] + b' ' * len(nt.node.value))
+    else:
+      prefix.append(b' ' * len(nt.node.value))
 
-    out.write(nt.node.pvalue)
+    parts.append(encode(nt.node.pvalue))
     if not nt.has_children:
-      out.write('\n')
+      parts.append(b'\n')
+      out.write(b''.join(parts))
+      del parts[:]
 
-def line_iter_from_file(infile, zero_terminated=False):
+def line_iter_from_binary(infile, encoding, zero_terminated=False,
+    blocksize=INPUT_BLOCK_SIZE):
   """
-  Break a file into a line iterator.
+  Break a binary file into a line iterator.
+
+  Splits big blocks at the last separator, and decodes all the lines
+  before it in one go. Undecodable bytes become surrogates,
+  which encode back to the same bytes for ls and for output.
+  Lines are exactly what's between separators.
   """
 
   if zero_terminated:
-    # http://stromberg.dnsalias.org/~strombrg/readline0.html
-    return readline0(infile)
+    separator, str_separator = b'\0', '\0'
   else:
-    return (line.rstrip() for line in infile)
+    separator, str_separator = b'\n', '\n'
+  # Doesn't wait for a full block on pipes, which --stream relies on
+  read = getattr(infile, 'read1', infile.read)
+  # Start of a line, possibly in several blocks
+  partial = []
+  while True:
+    block = read(blocksize)
+    if not block:
+      break
+    end = block.rfind(separator)
+    if end < 0:
+      partial.append(block)
+      continue
+    partial.append(block[:end])
+    lines = b''.join(partial).decode(encoding, 'surrogateescape')
+    partial = [block[end + 1:]]
+    for line in lines.split(str_separator):
+      yield line
+  if any(partial):
+    yield b''.join(partial).decode(encoding, 'surrogateescape')
+
+def line_iter_from_mmap(path, encoding, zero_terminated=False,
+    chunksize=MMAP_CHUNK_SIZE):
+  """
+  Break a file into a line iterator, through a memory map.
+
+  Lines are cut out of the mapping in chunks ending at a separator,
+  each decoded in one go, like line_iter_from_binary does.
+  The file's contents are never copied into one Python object.
+  Pipes and other files that can't be mapped are read in blocks instead.
+  """
+
+  if zero_terminated:
+    separator, str_separator = b'\0', '\0'
+  else:
+    separator, str_separator = b'\n', '\n'
+  with open(path, 'rb') as infile:
+    st = os.fstat(infile.fileno())
+    if not stat.S_ISREG(st.st_mode):
+      for line in line_iter_from_binary(infile, encoding, zero_terminated):
+        yield line
+      return
+    size = st.st_size
+    if not size:
+      return
+    mapping = mmap.mmap(infile.fileno(), size, access=mmap.ACCESS_READ)
+  if hasattr(mapping, 'madvise'):
+    mapping.madvise(mmap.MADV_SEQUENTIAL)
+  view = memoryview(mapping)
+  try:
+    start = 0
+    while start < size:
+      end = mapping.rfind(separator, start, start + chunksize)
+      if end < 0:
+        # A line longer than a chunk
+        end = mapping.find(separator, start + chunksize)
+        if end < 0:
+          end = size
+      lines = str(view[start:end], encoding, 'surrogateescape')
+      for line in lines.split(str_separator):
+        yield line
+      start = end + 1
+  finally:
+    view.release()
+    mapping.close()
+
+def sorted_line_iter(line_iter, memory=DEFAULT_SORT_MEMORY):
+  """
+  Sort a line iterator by path_sort_key, within a memory budget.
+
+  Sorted runs that outgrow the budget are spilled to temporary files,
+  which are merged back at the end.
+  Memory use is estimated, and only roughly.
+  """
+
+  runs = []
+  run = []
+  run_size = 0
+  for line in line_iter:
+    run.append(line)
+    # The line, plus its sort key
+    run_size += 2 * len(line) + 64 * (line.count('/') + 2)
+    if run_size >= memory:
+      run.sort(key=path_sort_key)
+      runs.append(spill_run(run))
+      run = []
+      run_size = 0
+  run.sort(key=path_sort_key)
+  if not runs:
+    return iter(run)
+  if run:
+    runs.append(spill_run(run))
+  return merge_runs(runs)
+
+def spill_run(run):
+  # No newline translation, names may contain \r
+  run_file = tempfile.TemporaryFile(
+      'w+', encoding=SPILL_ENCODING, errors='surrogateescape', newline='')
+  for line in run:
+    run_file.write(line)
+    run_file.write('\0')
+  run_file.seek(0)
+  return run_file
+
+def merge_runs(runs):
+  try:
+    for line in heapq.merge(
+        *[readline0(run_file) for run_file in runs], key=path_sort_key):
+      yield line
+  finally:
+    for run_file in runs:
+      run_file.close()
+
+def path_sort_key(path_str):
+  """
+  Order paths depth first, siblings by name, like tree and ls -R do.
+  """
+
+  return split_line(path_str)
+
+def parse_size(size_str):
+  """
+  Parse a byte count with an optional K, M or G suffix.
+  """
+
+  suffix = size_str[-1:].upper()
+  if suffix in SIZE_SUFFIXES and suffix:
+    size_str = size_str[:-1]
+  else:
+    suffix = ''
+  try:
+    size = int(size_str) * SIZE_SUFFIXES[suffix]
+  except ValueError:
+    raise argparse.ArgumentTypeError('invalid size: %r' % size_str)
+  if size <= 0:
+    raise argparse.ArgumentTypeError('size must be positive')
+  return size
 
 def split_line(path_str):
   if path_str[:2] == '//' and path_str[:3] != '///':
@@ -246,46 +694,487 @@ def split_line(path_str):
     # filter empty path components
     return [el for el in path_str.split('/') if el]
 
-def tree_from_line_iter(line_iter, skip_dot):
+class SiblingOrder(object):
+  """
+  Check that siblings come sorted, so that merging against the previous
+  path never repeats one.
+
+  Two orders are accepted: path_sort_key's, by name (--sort, tree),
+  and bytewise order, with a '/' after directories (git ls-files,
+  LANG=C sort). Siblings must stick to one of them.
+  In bytewise order, a file can be followed by names it is a prefix of,
+  then by a directory of the same name (find's a, a.b, a/x);
+  the files that could still come back that way are kept in a stack.
+  """
+
+  __slots__ = ('path_order', 'leaves', )
+
+  def __init__(self):
+    self.path_order = True
+    # None once bytewise order is ruled out
+    self.leaves = []
+
+  def follows(self, str_comp0, is_dir0, str_comp, is_dir):
+    """
+    Record str_comp after its previous sibling str_comp0.
+
+    Returns whether the siblings are still in order.
+    """
+
+    if self.path_order:
+      self.path_order = str_comp > str_comp0
+    leaves = self.leaves
+    if leaves is not None:
+      if (str_comp + '/' if is_dir else str_comp) <= \
+          (str_comp0 + '/' if is_dir0 else str_comp0):
+        leaves = None
+      else:
+        if not is_dir0:
+          leaves.append(str_comp0)
+        while leaves:
+          leaf = leaves[-1]
+          if '' < str_comp[len(leaf):len(leaf) + 1] < '/' and \
+              str_comp.startswith(leaf):
+            break
+          leaves.pop()
+          if is_dir and leaf == str_comp:
+            leaves = None
+            break
+      self.leaves = leaves
+    return self.path_order or leaves is not None
+
+def tree_from_line_iter(line_iter, skip_dot, unsorted=False):
   """
   Convert a path_iter-style iterator to a tree.
 
   itr is a path_iter-style iterator.
   postprocess takes a path, and prettifies it.
+
+  Sorted input is merged against the previous path only.
+  Unsorted input is merged through a per-node index of children;
+  we switch to that as soon as a path would be appended before
+  its last sibling, which is the only way sorted merging could
+  create duplicate siblings.
   """
 
   root = Node('ROOT')
+  # The rightmost path of the tree
   node_path0 = []
+  # The SiblingOrder of each node of node_path0,
+  # None until a sibling comes after it
+  order_path0 = []
+  # Nodes that got a child index, dropped once the tree is built
+  indexed = []
+  # Share one string between all nodes with the same value;
+  # the table is dropped with this frame.
+  intern = {}.setdefault
   for line in line_iter:
     str_path = split_line(line)
-    parent = root
-    node_path = []
-    diverged = False
 
-    for node0, str_comp in itertools.zip_longest(node_path0, str_path):
-      if str_comp is None:
-        break
+    if not unsorted:
+      depth = 0
+      for node0, str_comp in zip(node_path0, str_path):
+        if node0.value != str_comp:
+          break
+        depth += 1
+      if depth == len(str_path):
+        # Already in the tree
+        continue
+      if depth < len(node_path0):
+        order = order_path0[depth]
+        if order is None:
+          order = order_path0[depth] = SiblingOrder()
+        unsorted = not order.follows(
+            node_path0[depth].value, depth + 1 < len(node_path0),
+            str_path[depth], depth + 1 < len(str_path))
+      if not unsorted:
+        parent = node_path0[depth - 1] if depth else root
+        del node_path0[depth:]
+        del order_path0[depth + 1:]
+        order_path0 += [None] * (len(str_path) - len(order_path0))
+        for str_comp in str_path[depth:]:
+          node = Node(intern(str_comp, str_comp))
+          parent.children.append(node)
+          node_path0.append(node)
+          parent = node
+        continue
 
-      diverged = diverged or node0 is None or node0.value != str_comp
-      if not diverged:
-        node = node0
-      else:
-        node = Node(str_comp)
+    parent = root
+    for str_comp in str_path:
+      if parent.index is None:
+        indexed.append(parent)
+      index = parent.child_index()
+      node = index.get(str_comp)
+      if node is None:
+        node = Node(intern(str_comp, str_comp))
         parent.children.append(node)
-
-      node_path.append(node)
+        index[node.value] = node
       parent = node
 
-    node_path0 = node_path
+  # The indexes are only needed while building
+  for node in indexed:
+    node.index = None
   if skip_dot and len(root.children) == 1 and root.children[0].value == '.':
     root = root.children[0]
   return root
 
-def postprocess_path(nt_bulk):
+def tree_from_line_iter_parallel(line_iter, skip_dot, jobs, unsorted=False):
+  """
+  Convert a path_iter-style iterator to a CompactTree, using several processes.
+
+  Lines are grouped by their first component (their first two with
+  skip_dot, since those all start with a dot). Workers build a CompactTree
+  for each group, which is grafted below its prefix node as it comes,
+  without copying its nodes. The result displays like tree_from_line_iter's.
+  """
+
+  split_depth = 2 if skip_dot else 1
+  tree = CompactTree()
+  groups = collections.OrderedDict()
+  line_count = 0
+  # The text of the last group's prefix, while lines keep starting with it
+  group_start = None
+  for line in line_iter:
+    if group_start is not None and line.startswith(group_start):
+      group_lines.append(line)
+      line_count += 1
+      continue
+    str_prefix = split_prefix(line, split_depth)
+    # Create prefix nodes in input order, to keep sibling order
+    parent = tree.root
+    for str_comp in str_prefix:
+      index = tree.child_index(parent)
+      node = index.get(str_comp)
+      if node is None:
+        node = index[str_comp] = tree.add_child(parent, str_comp)
+      parent = node
+    group_start = None
+    if len(str_prefix) == split_depth:
+      group_lines = groups.setdefault(parent, [])
+      group_lines.append(line)
+      line_count += 1
+      if str_prefix[0] not in SPECIALS:
+        group_start = '/'.join(str_prefix) + '/'
+  tree.indexes.clear()
+
+  # A few tasks per process, so that big groups don't leave others idle
+  task_size = max(1, line_count // (jobs * 4))
+  tasks = []
+  task = []
+  task_lines = 0
+  for lines in groups.values():
+    task.append(lines)
+    task_lines += len(lines)
+    if task_lines >= task_size:
+      tasks.append(task)
+      task = []
+      task_lines = 0
+  if task:
+    tasks.append(task)
+
+  nodes = iter(groups)
+  with multiprocessing.Pool(jobs) as pool:
+    for subtrees in pool.imap(
+        functools.partial(build_subtrees, split_depth, unsorted), tasks):
+      for subtree in subtrees:
+        tree.grafts[next(nodes)] = subtree
+
+  if skip_dot:
+    children = list(tree.iter_children(tree.root))
+    if len(children) == 1 and tree.value(children[0]) == '.':
+      tree.root = children[0]
+  return tree
+
+def split_prefix(path_str, depth):
+  """
+  Return the first depth components of a path, like split_line would.
+  """
+
+  # Fast path, for when the prefix has no empty components
+  str_prefix = path_str.split('/', depth)[:depth]
+  if '' in str_prefix or path_str[:1] == '/':
+    str_prefix = split_line(path_str)[:depth]
+  return str_prefix
+
+def build_subtrees(split_depth, unsorted, groups):
+  """
+  Build the subtrees of line groups that share their prefix.
+
+  Runs in a worker process.
+  Returns a (CompactTree, idx) pair for each group,
+  idx being the node its prefix ends at.
+  """
+
+  subtrees = []
+  for lines in groups:
+    tree = compact_tree_from_line_iter(
+        lines, skip_dot=False, unsorted=unsorted)
+    idx = tree.root
+    for i in range(split_depth):
+      idx = tree.first_children[idx]
+    subtrees.append((tree, idx))
+  return subtrees
+
+def tree_from_preorder(parent, entries, intern):
+  """
+  Build the tree below parent from walk_preorder's (depth, value, is_dir).
+
+  Depth 1 is a child of parent.
+  """
+
+  node_path = [parent]
+  for depth, value, is_dir in entries:
+    del node_path[depth:]
+    node = Node(intern(value, value))
+    node_path[-1].children.append(node)
+    node_path.append(node)
+
+def tree_from_walk(threads=arbo_sources.DEFAULT_WALK_THREADS):
+  """
+  Build the tree below the current directory, without running find.
+
+  The root is '.', as tree_from_line_iter gives with skip_dot.
+  """
+
+  root = Node('.')
+  tree_from_preorder(
+      root, arbo_sources.walk_preorder('.', threads), {}.setdefault)
+  return root
+
+def compact_tree_from_line_iter(line_iter, skip_dot, unsorted=False):
+  """
+  Convert a path_iter-style iterator to a CompactTree.
+
+  Merges paths exactly like tree_from_line_iter.
   """
-  Take a path, colorize and quote it.
 
-  Assumes the path is to an existing file, rooted in the current directory.
+  tree = CompactTree()
+  # The rightmost path of the tree, as indices and as values
+  node_path0 = []
+  str_path0 = []
+  order_path0 = []
+  for line in line_iter:
+    str_path = split_line(line)
+
+    if not unsorted:
+      depth = 0
+      for str_comp0, str_comp in zip(str_path0, str_path):
+        if str_comp0 != str_comp:
+          break
+        depth += 1
+      if depth == len(str_path):
+        continue
+      if depth < len(str_path0):
+        order = order_path0[depth]
+        if order is None:
+          order = order_path0[depth] = SiblingOrder()
+        unsorted = not order.follows(
+            str_path0[depth], depth + 1 < len(str_path0),
+            str_path[depth], depth + 1 < len(str_path))
+      if not unsorted:
+        parent = node_path0[depth - 1] if depth else tree.root
+        del node_path0[depth:]
+        del str_path0[depth:]
+        del order_path0[depth + 1:]
+        order_path0 += [None] * (len(str_path) - len(order_path0))
+        for str_comp in str_path[depth:]:
+          parent = tree.add_child(parent, str_comp)
+          node_path0.append(parent)
+          str_path0.append(str_comp)
+        continue
+
+    parent = tree.root
+    for str_comp in str_path:
+      index = tree.child_index(parent)
+      node = index.get(str_comp)
+      if node is None:
+        node = index[str_comp] = tree.add_child(parent, str_comp)
+      parent = node
+
+  # The indexes are only needed while building
+  tree.indexes.clear()
+  if skip_dot:
+    children = list(tree.iter_children(tree.root))
+    if len(children) == 1 and tree.value(children[0]) == '.':
+      tree.root = children[0]
+  return tree
+
+class NotSorted(ValueError):
+  """
+  Raised by stream_traversals on a path that isn't in DFS order,
+  one that goes back into a directory or file already left.
+  """
+
+class NotUnderDot(ValueError):
+  """
+  Raised by stream_traversals with skip_dot, on a path outside of '.'.
+  """
+
+def regroup_prefixed_siblings(path_iter):
+  """
+  Move the children of a file right after it, when bytewise order
+  put siblings extending its name in between.
+
+  path_iter yields (line, str_path) pairs.
+  In bytewise order (find |LANG=C sort) a is followed by a.b,
+  and a/x only comes after it, as in SiblingOrder.
+  A leaf is kept open while its later siblings start with its name
+  followed by a character below '/', and those siblings are held back
+  until one sorts after the leaf's name and a '/'.
+  Only the held back siblings are kept in memory; DFS order goes through
+  unchanged.
+  """
+
+  # [prefix, leaf, dest, held] for each open leaf, innermost last;
+  # prefix + [leaf] is the leaf's path, dest is where it went
+  frames = []
+  out = []
+  str_path0 = []
+  dest0 = out
+  for item in path_iter:
+    line, str_path = item
+    if str_path0:
+      depth = len(str_path0) - 1
+      leaf = str_path0[-1]
+      if len(str_path) > depth:
+        str_comp = str_path[depth]
+        if str_comp != leaf and str_comp.startswith(leaf) \
+            and str_comp[len(leaf)] < '/' \
+            and str_path[:depth] == str_path0[:depth]:
+          frames.append([str_path0[:depth], leaf, dest0, []])
+
+    dest = out
+    while frames:
+      prefix, leaf, leaf_dest, held = frames[-1]
+      depth = len(prefix)
+      if len(str_path) > depth and str_path[:depth] == prefix:
+        str_comp = str_path[depth]
+        if str_comp == leaf:
+          # Below the leaf, it goes where the leaf went
+          dest = leaf_dest
+          break
+        if str_comp.startswith(leaf) and str_comp[len(leaf)] < '/':
+          dest = held
+          break
+      frames.pop()
+      leaf_dest.extend(held)
+
+    dest.append(item)
+    str_path0 = str_path
+    dest0 = dest
+    if out:
+      for item in out:
+        yield item
+      del out[:]
+
+  while frames:
+    frames[-1][2].extend(frames.pop()[3])
+  for item in out:
+    yield item
+
+def stream_traversals(line_iter, skip_dot):
+  """
+  Convert a DFS-ordered path_iter-style iterator to traversals.
+
+  Yields what tree.traverse_skip_root() would yield for the same input,
+  as soon as display_tree_narrow has everything it needs.
+  A node's is_last_sib is only known once a later path leaves it,
+  so lines wait until their ancestors below the first level are closed.
+  Only the current path, the names already left at each of its levels,
+  and the waiting lines are kept in memory. Siblings may come
+  in any order, as long as none comes back once left.
+  Bytewise sorted input is accepted too, through
+  regroup_prefixed_siblings.
+
+  Nodes only remember their last two children, enough to know
+  whether they have one.
+  """
+
+  def path_iter():
+    for line in line_iter:
+      str_path = split_line(line)
+      if not str_path:
+        # Blank lines, which tree_from_line_iter skips as well
+        continue
+      if skip_dot:
+        if str_path[0] != '.':
+          raise NotUnderDot(line)
+        del str_path[0]
+      yield line, str_path
+
+  root_nt = NodeTraversal(Node('.' if skip_dot else 'ROOT'), None, True, True)
+  # The current path, as traversals and as values
+  nt_path0 = [root_nt]
+  str_path0 = []
+  # The siblings each value of str_path0 came after, None for none
+  closed_path0 = []
+  # (anchor, nt) pairs; nt can be displayed once anchor is closed
+  waiting = collections.deque()
+
+  def close(depth, is_last_sib):
+    for nt in nt_path0[depth + 1:]:
+      nt.is_last_sib = True
+    if depth < len(nt_path0):
+      nt_path0[depth].is_last_sib = is_last_sib
+    del nt_path0[depth:]
+    del str_path0[depth - 1:]
+
+  def ready(anchor):
+    if anchor.is_last_sib is not None:
+      return True
+    # First level nodes only wait to know if they have a single child
+    return anchor.parent is root_nt and len(anchor.node.children) > 1
+
+  for line, str_path in regroup_prefixed_siblings(path_iter()):
+    depth = 0
+    for str_comp0, str_comp in zip(str_path0, str_path):
+      if str_comp0 != str_comp:
+        break
+      depth += 1
+    if depth == len(str_path):
+      continue
+    if depth < len(str_path0):
+      closed = closed_path0[depth]
+      if closed is None:
+        closed = closed_path0[depth] = set()
+      closed.add(str_path0[depth])
+      if str_path[depth] in closed:
+        raise NotSorted(line)
+      # Closes the previous sibling and everything below it
+      close(depth + 1, False)
+    del closed_path0[depth + 1:]
+    closed_path0 += [None] * (len(str_path) - len(closed_path0))
+
+    parent_nt = nt_path0[-1]
+    for str_comp in str_path[depth:]:
+      node = Node(str_comp)
+      siblings = parent_nt.node.children
+      nt = NodeTraversal(node, parent_nt, not siblings, None)
+      if len(siblings) < 2:
+        siblings.append(node)
+      else:
+        siblings[1] = node
+      nt_path0.append(nt)
+      str_path0.append(str_comp)
+      waiting.append((nt_path0[min(len(nt_path0) - 1, 2)], nt))
+      parent_nt = nt
+
+    while waiting and ready(waiting[0][0]):
+      yield waiting.popleft()[1]
+
+  close(1, True)
+  for anchor, nt in waiting:
+    yield nt
+
+def start_postprocess(nt_bulk):
+  """
+  Start colorizing and quoting a batch of paths with ls.
+
+  Returns what finish_postprocess needs; nothing is read from ls yet,
+  so several batches can be in flight.
+
+  Assumes the paths are rooted in the current directory.
+  Paths that don't exist are left as they are.
 
   ls's colorisation logic is complicated, it has to handle stuff like
   LS_COLORS and that means parsing a lot of stat info.
@@ -304,6 +1193,11 @@ def postprocess_path(nt_bulk):
   Otherwise the output is exactly what ls gives us.
   """
 
+  # Package lists and indexes may name files that are gone;
+  # ls would skip them, and its output wouldn't line up.
+  nt_bulk = [nt for nt in nt_bulk if os.path.lexists(nt.path_str)]
+  if not nt_bulk:
+    return nt_bulk, None
   path_strs = [nt.path_str for nt in nt_bulk]
 
   # Acceptable quoting styles:
@@ -315,10 +1209,19 @@ def postprocess_path(nt_bulk):
   proc = subprocess.Popen(
       'ls -1dU --color=always --quoting-style=escape --'.split() \
       + path_strs, stdout=subprocess.PIPE)
+  return nt_bulk, proc
 
+
+def finish_postprocess(nt_bulk, proc):
+  """
+  Read what ls has to say about a batch of paths, and update their nodes.
+  """
+
+  if proc is None:
+    return
   nt_iter = iter(nt_bulk)
   for line in proc.stdout:
-    line = line.decode('utf8')
+    line = line.decode('utf8', 'surrogateescape')
     if line == END_LS:
       #sys.stderr.write('END_LS\n')
       continue
@@ -337,6 +1240,359 @@ def postprocess_path(nt_bulk):
     raise RuntimeError('Failed to postprocess paths')
 
 
+def git_index_lines(repo):
+  """
+  List a git work tree's paths from its index, without running git.
+
+  Returns None if repo isn't a git work tree, or if git ls-files
+  has to read the index for us.
+  """
+
+  if repo.source != 'git' or repo.bare:
+    return None
+  try:
+    return [path for path, mode in arbo_sources.git_index_paths(repo.root)]
+  except arbo_sources.UnsupportedIndex:
+    return None
+
+
+def git_tree_lines(treeish, encoding):
+  """
+  List the files of a git commit or tree, from its top.
+
+  Returns (paths, modes): paths come in git's bytewise tree order,
+  and modes maps them to their git modes.
+  """
+
+  output = subprocess.check_output(
+      ['git', 'ls-tree', '-r', '-z', '--full-tree', treeish, ])
+  paths = []
+  modes = {}
+  for record in output.split(b'\0'):
+    if not record:
+      continue
+    # mode, type and object, a tab, the path
+    meta, path = record.split(b'\t', 1)
+    path = path.decode(encoding, 'surrogateescape')
+    paths.append(path)
+    modes[path] = int(meta.split(b' ', 1)[0], 8)
+  return paths, modes
+
+
+def dpkg_lines(packages, all_packages):
+  """
+  List the files of installed packages from dpkg's database.
+
+  Returns (paths, owners): paths are sorted and merged across packages,
+  owners maps each path to the packages listing it.
+  Returns (None, None) if dpkg -L has to be run.
+  """
+
+  try:
+    if all_packages:
+      lists = arbo_sources.all_dpkg_lists()
+    else:
+      lists = arbo_sources.find_dpkg_lists(packages)
+  except arbo_sources.Unsupported:
+    return None, None
+  owners = {}
+  for package, paths in arbo_sources.dpkg_package_paths(lists):
+    for path in paths:
+      owners.setdefault(path, []).append(package)
+  return sorted(owners, key=path_sort_key), owners
+
+
+def dpkg_cmd_lines(cmd, packages):
+  """
+  List the files of packages by running cmd (dpkg -L) once for each.
+
+  Returns (paths, owners) like dpkg_lines does, for --annotate when
+  dpkg's database can't be read in-process.
+  """
+
+  owners = {}
+  for package in packages:
+    output = subprocess.check_output(cmd + [package])
+    for line in output.split(b'\n'):
+      if line and line != b'/.':
+        owners.setdefault(os.fsdecode(line), []).append(package)
+  return sorted(owners, key=path_sort_key), owners
+
+
+def annotate_leaves(tree_root, owners):
+  """
+  Note which packages own each leaf of a tree.
+  """
+
+  for nt in tree_root.traverse_skip_root():
+    if not nt.has_children:
+      packages = owners.get(nt.path_str)
+      if packages is not None:
+        nt.node.note = ', '.join(packages)
+
+
+def hg_lines():
+  """
+  List an hg checkout from its dirstate, without running hg.
+
+  Returns (root, sorted paths), or (None, None) if hg locate
+  has to be run.
+  """
+
+  try:
+    root, paths = arbo_sources.hg_dirstate_paths()
+  except arbo_sources.Unsupported:
+    return None, None
+  return root, sorted(paths, key=path_sort_key)
+
+
+def cvs_lines(threads=arbo_sources.DEFAULT_WALK_THREADS):
+  """
+  List a CVS checkout from its CVS/Entries files, without running cvsu.
+
+  Returns an iterator of sorted paths, or None if cvsu has to be run.
+  """
+
+  try:
+    return arbo_sources.cvs_checkout_paths(threads=threads)
+  except arbo_sources.Unsupported:
+    return None
+
+
+def svn_lines():
+  """
+  List an svn working copy from its database, without going online.
+
+  Returns sorted paths, or None if svn list has to be run.
+  """
+
+  try:
+    return sorted(arbo_sources.svn_wc_paths(), key=path_sort_key)
+  except arbo_sources.Unsupported:
+    return None
+
+
+def run_checkout_cmd(repo, cmd, zero_terminated):
+  """
+  List a checkout's files by running cmd at its root.
+
+  Returns (path, mode) pairs like arbo_sources.checkout_paths;
+  git modes are asked for, so that submodules can be found.
+  """
+
+  if repo.source == 'git':
+    if repo.bare:
+      cmd = ['git', 'ls-tree', '-r', '-z', 'HEAD', ]
+    else:
+      cmd = ['git', 'ls-files', '-z', '--stage', ]
+    zero_terminated = True
+  output = subprocess.run(
+      cmd, cwd=repo.root, stdout=subprocess.PIPE, check=True).stdout
+  entries = []
+  for record in output.split(b'\0' if zero_terminated else b'\n'):
+    if not record:
+      continue
+    mode = None
+    if repo.source == 'git':
+      # mode, then object and stage (or type and object), a tab, the path
+      meta, record = record.split(b'\t', 1)
+      mode = int(meta.split()[0], 8)
+    path = os.fsdecode(record)
+    if path.startswith('./'):
+      path = path[2:]
+    if path and path != '.':
+      entries.append((path, mode))
+  return entries
+
+
+def list_checkout(mount, repo, commands):
+  """
+  List the files of a checkout below mount.
+
+  Returns the paths, as seen from the current directory through mount,
+  and the mounts of the git submodules checked out below it.
+  commands maps sources to their (cmd, zero_terminated), for those
+  arbo_sources can't read.
+  """
+
+  try:
+    entries = arbo_sources.checkout_paths(repo)
+  except arbo_sources.Unsupported:
+    entries = run_checkout_cmd(repo, *commands[repo.source])
+
+  prefix = os.path.relpath(os.path.abspath(mount), repo.root)
+  prefix = '' if prefix == os.curdir else prefix + '/'
+  mount = '' if mount == os.curdir else mount + '/'
+  lines = []
+  submodules = []
+  for path, mode in entries:
+    if not path.startswith(prefix):
+      continue
+    line = mount + path[len(prefix):]
+    lines.append(line)
+    if mode == arbo_sources.GIT_MODE_GITLINK:
+      submodules.append(line)
+  return lines, submodules
+
+
+class NotACheckout(Exception):
+  """
+  Raised by multi_checkout_lines on a mount that isn't in a checkout.
+  """
+
+
+def multi_checkout_lines(mounts, commands, threads, submodules):
+  """
+  List several checkouts at once, as one sorted list of paths.
+
+  Checkouts are listed in a thread pool, each by arbo_sources
+  or by running its command. With submodules, git submodules that are
+  checked out are queued as their superproject's listing comes back,
+  and grafted below their mount.
+  """
+
+  lines = []
+  with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+    pending = set()
+
+    def submit(mount, repo):
+      pending.add(pool.submit(list_checkout, mount, repo, commands))
+
+    for mount in mounts:
+      repo = arbo_sources.find_repo(mount)
+      if repo is None:
+        raise NotACheckout(mount)
+      submit(mount, repo)
+    while pending:
+      done, pending = concurrent.futures.wait(
+          pending, return_when=concurrent.futures.FIRST_COMPLETED)
+      for future in done:
+        checkout_lines, gitlinks = future.result()
+        lines.extend(checkout_lines)
+        if not submodules:
+          continue
+        for mount in gitlinks:
+          repo = arbo_sources.find_repo(mount)
+          # Submodules that aren't checked out are just a directory
+          if repo is not None and repo.root == os.path.abspath(mount):
+            submit(mount, repo)
+  lines.sort(key=path_sort_key)
+  return lines
+
+
+def fossil_lines():
+  """
+  List a fossil checkout from its database, without running fossil.
+
+  Returns (root, sorted paths), or (None, None) if fossil ls
+  has to be run.
+  """
+
+  try:
+    root, paths = arbo_sources.fossil_checkout_paths()
+  except arbo_sources.Unsupported:
+    return None, None
+  return root, sorted(paths, key=path_sort_key)
+
+
+# Each *_source function lists a checkout for main, for its subcommand
+# and for auto. repo is the checkout auto found, or None.
+# They return (chdir, lines, modes): lines are read in-process, or None
+# when args.cmd has to be run, from chdir; modes are git modes,
+# for when files are listed from a tree.
+# Unlike git, svn, cvs and bzr, the output of hg, darcs, and fossil ls
+# is rooted in the repo; fossil's database is listed from the current
+# directory.
+
+def git_source(args, repo, encoding):
+  rev = args.rev
+  if rev is None and not args.ls_files:
+    if repo is None:
+      repo = arbo_sources.find_repo()
+    if repo is not None and repo.source == 'git':
+      if repo.bare:
+        # No work tree; display what is checked in
+        rev = 'HEAD'
+      else:
+        if repo.git_dir is not None:
+          # Inside .git; list the work tree
+          os.chdir(repo.root)
+        lines = git_index_lines(repo)
+        if lines is not None:
+          return None, lines, None
+  chdir = None
+  if rev is None:
+    # A bit more complicated to support outside worktree operation.
+    is_inside_work_tree = subprocess.check_output(
+        ['git', 'rev-parse', '--is-inside-work-tree', ],
+        ).rstrip() == b'true'
+    if not is_inside_work_tree:
+      is_bare_repository = subprocess.check_output(
+          ['git', 'rev-parse', '--is-bare-repository', ],
+          ).rstrip() == b'true'
+      if is_bare_repository:
+        rev = 'HEAD'
+      else:
+        git_root = subprocess.check_output(
+            ['git', 'rev-parse', '--show-cdup', ],
+            ).rstrip()
+        # Empty if at repo root; correctly bombs outside repo.
+        if git_root:
+          chdir = git_root
+  if rev is not None:
+    lines, modes = git_tree_lines(rev, encoding)
+    return None, lines, modes
+  return chdir, None, None
+
+
+def hg_source(args, repo):
+  if not args.locate:
+    root, lines = hg_lines()
+    if lines is not None:
+      return root, lines, None
+  if repo is not None:
+    return repo.root, None, None
+  return subprocess.check_output(['hg', 'root', ]).rstrip(), None, None
+
+
+def darcs_source(args, repo):
+  if repo is not None:
+    return repo.root, None, None
+  return subprocess.check_output(
+      ['sh', '-c', 'darcs show repo |sed -n "s#^[[:space:]]*Root: ##p"', ],
+      ).rstrip(), None, None
+
+
+def cvs_source(args, repo):
+  if args.cvsu:
+    return None, None, None
+  return None, cvs_lines(args.threads), None
+
+
+def bzr_source(args, repo):
+  # Nothing to read in-process, bzr ls does the listing
+  return None, None, None
+
+
+def svn_source(args, repo):
+  if args.online:
+    return None, None, None
+  return None, svn_lines(), None
+
+
+def fossil_source(args, repo):
+  if not args.fossil_ls:
+    root, lines = fossil_lines()
+    if lines is not None:
+      return root, lines, None
+  if repo is not None:
+    return repo.root, None, None
+  return subprocess.check_output(
+      ['sh', '-c',
+       'fossil info |sed -n "s#^local-root:[[:space:]]*##p"', ],
+      ).rstrip(), None, None
+
+
 def main():
   """
   Read from stdin, display to stdout.
@@ -352,11 +1608,36 @@ def main():
 
   locale.setlocale(locale.LC_ALL, '')
   sysencoding = locale.getpreferredencoding(False)
-  reader_factory = codecs.getreader(sysencoding)
+  # What ls would quote for; Python's UTF-8 mode doesn't change it
+  locale_encoding = codecs.lookup(locale.nl_langinfo(locale.CODESET)).name
+  if locale_encoding == codecs.lookup(sysencoding).name:
+    locale_encoding = None
 
   parser = argparse.ArgumentParser()
   parser.add_argument('--wide', action='store_true', dest='wide',
       help='Use more horizontal space and less vertical space')
+  parser.add_argument('--unsorted', action='store_true', dest='unsorted',
+      help='Input is not sorted; merge paths by name from the start '
+           '(this is also detected automatically)')
+  parser.add_argument('--compact', action='store_true', dest='compact',
+      help='Keep the tree in compact arrays; '
+           'a bit slower, but uses several times less memory')
+  parser.add_argument('--stream', action='store_true', dest='stream',
+      help='Input is in DFS order, like find\'s, or bytewise sorted; '
+           'display it while reading, '
+           'without keeping a tree in memory')
+  parser.add_argument('--jobs', '-j', type=int, default=1, metavar='N',
+      dest='jobs',
+      help='Build the tree with N processes')
+  parser.add_argument('--run-ls', action='store_true', dest='run_ls',
+      help='Colorize by running ls on batches of paths, '
+           'rather than by looking at files in-process')
+  parser.add_argument('--sort', action='store_true', dest='sort',
+      help='Sort the input first, using temporary files if needed')
+  parser.add_argument('--sort-memory', type=parse_size,
+      default=DEFAULT_SORT_MEMORY, metavar='SIZE', dest='sort_memory',
+      help='Roughly how much memory --sort may use before spilling '
+           'to temporary files; K, M and G suffixes are accepted')
 
   # XXX http://bugs.python.org/issue9253
   sub = parser.add_subparsers(dest='source', default='stdin')
@@ -368,6 +1649,8 @@ def main():
   sub_stdin = sub.add_parser('stdin',
       description='Display paths listed from stdin (the default)')
   sub_stdin.set_defaults(cmd=None)
+  sub_stdin.add_argument('--file', '-f', metavar='FILE', dest='infile',
+      help='Read paths from FILE, memory-mapped, rather than from stdin')
   sub_stdin.add_argument('-0',
       action='store_true', dest='zero_terminated',
       help='Input is zero-terminated')
@@ -385,9 +1668,24 @@ def main():
     cmd=['find', '-print0', ],
     zero_terminated=True, colorize=True, skip_dot=True)
 
+  sub_walk = sub.add_parser('walk',
+      description='Display files below the current directory, '
+                  'reading directories in-process instead of running find')
+  sub_walk.add_argument('--threads', type=int,
+      default=arbo_sources.DEFAULT_WALK_THREADS, metavar='N', dest='threads',
+      help='Read up to N directories at once')
+  sub_walk.set_defaults(
+    cmd=None, zero_terminated=True, colorize=True, skip_dot=True)
+
   sub_dpkg = sub.add_parser('dpkg',
-      description='List a package\'s files')
-  sub_dpkg.add_argument('package')
+      description='List the files of installed packages')
+  sub_dpkg.add_argument('packages', nargs='*', metavar='package')
+  sub_dpkg.add_argument('--all',
+      action='store_true', dest='all_packages',
+      help='List the files of all installed packages')
+  sub_dpkg.add_argument('--annotate',
+      action='store_true', dest='annotate',
+      help='Show the packages owning each file')
   sub_dpkg.set_defaults(
     cmd=['dpkg', '-L', '--', ],
     zero_terminated=False, colorize=True, skip_dot=False)
@@ -401,26 +1699,51 @@ def main():
 
   sub_cvs = sub.add_parser('cvs',
       description='Display cvs-managed files')
+  sub_cvs.add_argument('--cvsu',
+      action='store_true', dest='cvsu',
+      help='Run cvsu rather than reading CVS/Entries files in-process')
+  sub_cvs.add_argument('--threads', type=int,
+      default=arbo_sources.DEFAULT_WALK_THREADS, metavar='N', dest='threads',
+      help='Read up to N directories at once')
   sub_cvs.set_defaults(
     cmd=['cvsu', '--find', '--types=AFGM', ],
     zero_terminated=False, colorize=True, skip_dot=False)
 
-  # This one is way too slow.
-  # The only command to go online.
+  # svn list is way too slow, and the only command to go online;
+  # the working copy's database is read instead, unless asked.
   sub_svn = sub.add_parser('svn',
       description='Display svn-managed files')
+  sub_svn.add_argument('--online',
+      action='store_true', dest='online',
+      help='Run svn list, which lists the repository, '
+           'rather than reading the working copy')
   sub_svn.set_defaults(
     cmd=['svn', 'list', '-R', ],
     zero_terminated=False, colorize=True, skip_dot=False)
 
   sub_git = sub.add_parser('git',
       description='Display git-managed files')
+  sub_git.add_argument('--rev', metavar='TREEISH', dest='rev',
+      help='Display the files of a commit or tree instead, '
+           'colored by their mode; works in bare repositories')
+  sub_git.add_argument('--ls-files',
+      action='store_true', dest='ls_files',
+      help='Run git ls-files rather than reading the index directly')
+  sub_git.add_argument('--recurse-submodules',
+      action='store_true', dest='recurse_submodules',
+      help='Also display the files of checked out submodules')
+  sub_git.add_argument('--threads', type=int,
+      default=arbo_sources.DEFAULT_WALK_THREADS, metavar='N', dest='threads',
+      help='List up to N submodules at once')
   sub_git.set_defaults(
     cmd=['git', 'ls-files', '-z', ],
     zero_terminated=True, colorize=True, skip_dot=False)
 
   sub_hg = sub.add_parser('hg',
       description='Display hg-managed files')
+  sub_hg.add_argument('--locate',
+      action='store_true', dest='locate',
+      help='Run hg locate rather than reading the dirstate')
   sub_hg.set_defaults(
     cmd=['hg', 'locate', '--include', '.', '-0', ],
     zero_terminated=True, colorize=True, skip_dot=False)
@@ -433,15 +1756,74 @@ def main():
 
   sub_fossil = sub.add_parser('fossil',
       description='Display fossil-managed files')
+  sub_fossil.add_argument('--ls',
+      action='store_true', dest='fossil_ls',
+      help='Run fossil ls rather than reading the checkout database')
   sub_fossil.set_defaults(
     cmd=['fossil', 'ls', ],
     zero_terminated=False, colorize=True, skip_dot=False)
 
+  sub_repos = sub.add_parser('repos',
+      description='Display the files of several checkouts at once, '
+                  'each managed by any version control system')
+  sub_repos.add_argument('roots', nargs='+', metavar='root')
+  sub_repos.add_argument('--recurse-submodules',
+      action='store_true', dest='recurse_submodules',
+      help='Also display the files of checked out git submodules')
+  sub_repos.add_argument('--threads', type=int,
+      default=arbo_sources.DEFAULT_WALK_THREADS, metavar='N', dest='threads',
+      help='List up to N checkouts at once')
+  sub_repos.set_defaults(
+    cmd=None, zero_terminated=False, colorize=True, skip_dot=False)
+
+  sub_auto = sub.add_parser('auto',
+      description='Display files managed by whichever version control '
+                  'system the current directory is in')
+  sub_auto.add_argument('--threads', type=int,
+      default=arbo_sources.DEFAULT_WALK_THREADS, metavar='N', dest='threads',
+      help='Read up to N directories at once, for cvs')
+  sub_auto.set_defaults(
+    cmd=None, zero_terminated=False, colorize=True, skip_dot=False)
+
   args = parser.parse_args()
   src = args.source
+  if args.stream and (args.wide or args.unsorted or args.compact):
+    parser.error(
+        '--stream can\'t be used with --wide, --unsorted or --compact')
+  if args.jobs < 1:
+    parser.error('--jobs must be at least 1')
+  if args.jobs > 1 and args.stream:
+    parser.error('--jobs can\'t be used with --stream')
+  if src == 'walk' and (
+      args.stream or args.sort or args.compact or args.jobs > 1):
+    parser.error(
+        'walk can\'t be used with --stream, --sort, --compact or --jobs')
+  if src == 'git' and args.rev is not None and args.recurse_submodules:
+    parser.error('--rev can\'t be used with --recurse-submodules')
+  if src == 'git' and args.ls_files and args.recurse_submodules:
+    parser.error('--ls-files can\'t be used with --recurse-submodules')
 
   # So colours work
   chdir = None
+  # Paths read in-process, when the source can do without args.cmd
+  native_lines = None
+  # Maps paths to the packages owning them, for dpkg --annotate
+  owners = None
+  # Maps paths to their git modes, when listing a tree rather than files
+  git_modes = None
+  # Set when some of the input couldn't be listed
+  exit_status = 0
+
+  # Sources that know checkouts, which auto picks from
+  checkout_sources = {
+    'git': functools.partial(git_source, encoding=sysencoding),
+    'hg': hg_source,
+    'darcs': darcs_source,
+    'bzr': bzr_source,
+    'cvs': cvs_source,
+    'svn': svn_source,
+    'fossil': fossil_source,
+  }
 
   if src == 'help':
     # Not really a source, this subcommand just shows the help
@@ -451,60 +1833,145 @@ def main():
       sub._name_parser_map[args.command].print_help()
     return
 
-  elif src == 'git':
-    # A bit more complicated to support outside worktree operation.
-    is_inside_work_tree = subprocess.check_output(
-        ['git', 'rev-parse', '--is-inside-work-tree', ],
-        ).rstrip() == b'true'
-    if not is_inside_work_tree:
-      is_bare_repository = subprocess.check_output(
-          ['git', 'rev-parse', '--is-bare-repository', ],
-          ).rstrip() == b'true'
-      if is_bare_repository:
-        colorize = False
-      else:
-        git_root = subprocess.check_output(
-            ['git', 'rev-parse', '--show-cdup', ],
-            ).rstrip()
-        # Empty if at repo root; correctly bombs outside repo.
-        if git_root:
-          chdir = git_root
-  # Unlike git, svn, cvs and bzr, the output of hg, darcs, and fossil
-  # is rooted in the repo.
-  elif src == 'hg':
-    chdir = subprocess.check_output(['hg', 'root', ]).rstrip()
-  elif src == 'darcs':
-    chdir = subprocess.check_output(
-        ['sh', '-c', 'darcs show repo |sed -n "s#^[[:space:]]*Root: ##p"', ],
-        ).rstrip()
-  elif src == 'fossil':
-    chdir = subprocess.check_output(
-        ['sh', '-c', 'fossil info |sed -n "s#^local-root:[[:space:]]*##p"', ],
-        ).rstrip()
+  elif src == 'repos' or src == 'git' and args.recurse_submodules:
+    commands = dict(
+        (name, (source_parser.get_default('cmd'),
+                source_parser.get_default('zero_terminated')))
+        for name, source_parser in sub._name_parser_map.items())
+    mounts = []
+    for mount in args.roots if src == 'repos' else [os.curdir]:
+      try:
+        os.lstat(mount)
+      except OSError as err:
+        # Reported like find does, the other mounts are still listed
+        sys.stderr.write('arbo: %s: %s\n' % (mount, err.strerror))
+        exit_status = 1
+        continue
+      mounts.append(os.path.normpath(mount))
+    try:
+      native_lines = multi_checkout_lines(
+          mounts, commands,
+          threads=args.threads, submodules=args.recurse_submodules)
+    except NotACheckout as err:
+      parser.error('%s: not inside a checkout' % err.args)
+  elif src in checkout_sources:
+    chdir, native_lines, git_modes = checkout_sources[src](args, None)
   elif src == 'dpkg':
-    args.cmd.append(args.package)
-
+    if not args.packages and not args.all_packages:
+      parser.error('give some packages, or --all')
+    if args.annotate and (args.stream or args.compact or args.jobs > 1):
+      parser.error(
+          '--annotate can\'t be used with --stream, --compact or --jobs')
+    native_lines, owners = dpkg_lines(args.packages, args.all_packages)
+    if native_lines is None:
+      if args.all_packages:
+        parser.error('can\'t read the dpkg database')
+      if args.annotate:
+        # One run per package, to know which owns what
+        native_lines, owners = dpkg_cmd_lines(args.cmd, args.packages)
+      else:
+        args.cmd.extend(args.packages)
+  elif src == 'auto':
+    # Find the checkout without running any VCS command,
+    # then list it like its own subcommand would by default.
+    repo = arbo_sources.find_repo()
+    if repo is None:
+      parser.error('not inside a checkout')
+    source_parser = sub._name_parser_map[repo.source]
+    for dest in ('cmd', 'zero_terminated', 'colorize', 'skip_dot', ):
+      setattr(args, dest, source_parser.get_default(dest))
+    for action in source_parser._actions:
+      if action.default is not argparse.SUPPRESS \
+          and not hasattr(args, action.dest):
+        setattr(args, action.dest, action.default)
+    args.cmd = list(args.cmd)
+    chdir, native_lines, git_modes = checkout_sources[repo.source](
+        args, repo)
+
+  if native_lines is not None:
+    args.cmd = None
   if args.cmd:
     fin_proc = subprocess.Popen(args.cmd, stdout=subprocess.PIPE)
-    fin = reader_factory(fin_proc.stdout)
+    fin = fin_proc.stdout
   else:
-    fin = sys.stdin
+    fin = sys.stdin.buffer
 
   if chdir:
     # Do this *after* Popen has forked
     os.chdir(chdir)
 
-  line_iter = line_iter_from_file(fin, zero_terminated=args.zero_terminated)
-  # We can't directly convert iterators without building a tree,
-  # because computing is_last_sib along the parent axis
-  # requires seeking forward.
-  tree = tree_from_line_iter(line_iter, skip_dot=args.skip_dot)
-  display_tree(tree, sys.stdout, wide=args.wide, colorize=args.colorize)
+  if git_modes is not None:
+    # The files may not be on disk
+    colorizer = functools.partial(
+        colorize_nt_iter_by_mode, modes=git_modes,
+        ls_colors=arbo_lscolors.LsColors(), encoding=sysencoding,
+        locale_encoding=locale_encoding)
+  elif args.run_ls:
+    colorizer = colorize_nt_iter
+  else:
+    colorizer = functools.partial(
+        colorize_nt_iter_lstat,
+        ls_colors=arbo_lscolors.LsColors(), encoding=sysencoding,
+        locale_encoding=locale_encoding)
+
+  out_fd = sys.stdout.fileno()
+  if os.isatty(out_fd):
+    out = ByteWriter(out_fd, sysencoding, bufsize=0)
+  else:
+    out = ByteWriter(out_fd, sysencoding)
+
+  try:
+    if src == 'walk':
+      tree = tree_from_walk(threads=args.threads)
+      display_tree(tree, out, wide=args.wide, colorize=args.colorize,
+          colorizer=colorizer)
+      return
+
+    if native_lines is not None:
+      line_iter = iter(native_lines)
+    elif getattr(args, 'infile', None) is not None:
+      line_iter = line_iter_from_mmap(
+          args.infile, sysencoding, zero_terminated=args.zero_terminated)
+    else:
+      line_iter = line_iter_from_binary(
+          fin, sysencoding, zero_terminated=args.zero_terminated)
+    if args.sort:
+      line_iter = sorted_line_iter(line_iter, memory=args.sort_memory)
+    # Without a whole tree, computing is_last_sib along the parent axis
+    # requires waiting until sorted input has left the parent.
+    if args.stream:
+      try:
+        display_stream(
+            line_iter, out, skip_dot=args.skip_dot, colorize=args.colorize,
+            colorizer=colorizer)
+      except NotSorted as err:
+        out.flush()
+        parser.error('%r was already left, try --sort' % err.args)
+      except NotUnderDot as err:
+        out.flush()
+        parser.error('%r is not under ., try without --skip-dot' % err.args)
+    else:
+      if args.jobs > 1:
+        build_tree = functools.partial(
+            tree_from_line_iter_parallel, jobs=args.jobs)
+      elif args.compact:
+        build_tree = compact_tree_from_line_iter
+      else:
+        build_tree = tree_from_line_iter
+      tree = build_tree(
+          line_iter, skip_dot=args.skip_dot, unsorted=args.unsorted)
+      if owners is not None and args.annotate:
+        annotate_leaves(tree, owners)
+      display_tree(tree, out, wide=args.wide, colorize=args.colorize,
+          colorizer=colorizer)
+  finally:
+    out.flush()
 
   if args.cmd:
     returncode = fin_proc.wait()
     if returncode:
       raise subprocess.CalledProcessError(args.cmd, returncode)
+  return exit_status
 
 if __name__ == '__main__':
   sys.exit(main())
@@ -536,5 +2003,33 @@ real    0m0.558s
 user    0m0.390s
 sys     0m0.070s
 
+Memory, bench/bench_memory.py, 200000 paths, 478107 nodes:
+Node, slotted             144.1 bytes/node
+Node with __dict__        239.3 bytes/node
+CompactTree                31.6 bytes/node
+
+Parallel build, bench/bench_jobs.py, 300000 paths, on a single core
+(so workers can't overlap; parent CPU is the part they can't take over,
+and bounds the speedup on enough cores):
+--jobs 1     2.40s  x1.00  parent CPU 2.37s, at most x1.0
+--jobs 2     2.50s  x0.96  parent CPU 0.35s, at most x6.9
+--jobs 4     2.71s  x0.88  parent CPU 0.39s, at most x6.1
+Before workers sent back CompactTrees, the parent rebuilt every node:
+--jobs 2     5.44s  x0.45  parent CPU 2.24s, at most x1.1
+
+Colorizing, arbo find in /usr (83955 paths), a warm cache:
+ls in bulk by 400 (--run-ls):
+real    0m2.893s
+In-process, from lstat:
+real    0m1.666s
+
+Colorizing alone, bench/bench_colorize.py /usr, on a single core
+(so concurrent ls calls only overlap our own work with ls's),
+median of 5 runs:
+ls, 1   at once    2.56s
+ls, 2   at once    2.08s
+ls, 4   at once    2.36s
+in-process         0.75s
+
 """
 
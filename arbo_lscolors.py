@@ -0,0 +1,297 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+"""
+Colors and quoting the way ls --color --quoting-style=escape does them.
+"""
+
+from __future__ import absolute_import
+
+import fnmatch
+import os
+import re
+import stat
+import string
+import unicodedata
+
+import arbo_sources
+
+# What ls uses when LS_COLORS is unset
+DEFAULT_INDICATORS = {
+  'lc': '\033[', 'rc': 'm', 'ec': None, 'rs': '0',
+  'no': None, 'fi': None, 'di': '01;34', 'ln': '01;36', 'pi': '33',
+  'so': '01;35', 'bd': '01;33', 'cd': '01;33', 'mi': None, 'or': None,
+  'ex': '01;32', 'do': '01;35', 'su': '37;41', 'sg': '30;43',
+  'st': '37;44', 'ow': '34;42', 'tw': '30;42', 'ca': None, 'mh': None,
+  'cl': '\033[K',
+}
+
+# Without LS_COLORS, ls only colors for these terminals (or with COLORTERM);
+# the TERM lines of dircolors -p
+KNOWN_TERMS = (
+  'Eterm', 'ansi', '*color*', 'con[0-9]*x[0-9]*', 'cons25', 'console',
+  'cygwin', '*direct*', 'dtterm', 'gnome', 'hurd', 'jfbterm', 'konsole',
+  'kterm', 'linux', 'linux-c', 'mlterm', 'putty', 'rxvt*', 'screen*', 'st',
+  'terminator', 'tmux*', 'vt100', 'xterm*',
+)
+
+# Backslash escapes LS_COLORS values may use, besides octal and hex ones
+LS_COLORS_ESCAPES = {
+  'a': '\a', 'b': '\b', 'e': '\033', 'f': '\f', 'n': '\n', 'r': '\r',
+  't': '\t', 'v': '\v', '?': '\177', '_': ' ',
+}
+LS_COLORS_ESCAPE_RE = re.compile(
+  r'\\(?:([0-7]{1,3})|[xX]([0-9a-fA-F]{1,2})|(.))|\^(.)', re.DOTALL)
+
+# How --quoting-style=escape writes control characters
+QUOTE_ESCAPES = {
+  '\a': '\\a', '\b': '\\b', '\f': '\\f', '\n': '\\n', '\r': '\\r',
+  '\t': '\\t', '\v': '\\v', '\\': '\\\\', ' ': '\\ ',
+}
+# What glibc's iswprint rejects: controls, surrogates, unassigned code
+# points, and the line and paragraph separators
+UNPRINTABLE_CATEGORIES = frozenset(('Cc', 'Cs', 'Cn', 'Zl', 'Zp', ))
+# ls matches suffixes with c_strncasecmp
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# Plain names need no quoting, which is the common case
+UNQUOTED_RE = re.compile(r'[!-\[\]-~]*\Z')
+
+
+def unescape_ls_color(value):
+  """
+  Decode the escapes of an LS_COLORS value, as dircolors writes them.
+  """
+
+  def replace(match):
+    octal, hexa, char, caret = match.groups()
+    if octal is not None:
+      return chr(int(octal, 8))
+    if hexa is not None:
+      return chr(int(hexa, 16))
+    if char is not None:
+      return LS_COLORS_ESCAPES.get(char, char)
+    if caret == '?':
+      return '\177'
+    return chr(ord(caret) & 0x1f)
+
+  return LS_COLORS_ESCAPE_RE.sub(replace, value)
+
+
+def is_colored(code):
+  """
+  Whether a code shows; ls only picks special file types that have one.
+  """
+
+  return code not in (None, '', '0', '00', )
+
+
+class LsColors(object):
+  """
+  Parsed LS_COLORS: colors by file type indicator, and by name suffix.
+  """
+
+  def __init__(self, ls_colors=None):
+    if ls_colors is None:
+      ls_colors = os.environ.get('LS_COLORS', '')
+    self.enabled = bool(ls_colors) or known_term_type()
+    self.indicators = dict(DEFAULT_INDICATORS)
+    # Later definitions win, so they are looked at first
+    self.suffixes = []
+    for item in ls_colors.split(':'):
+      key, sep, value = item.partition('=')
+      if not sep:
+        continue
+      value = unescape_ls_color(value)
+      if key.startswith('*'):
+        suffix = unescape_ls_color(key[1:]).translate(ASCII_LOWER)
+        self.suffixes.insert(0, (suffix, value))
+      elif key in self.indicators:
+        self.indicators[key] = value
+    # ln=target colors symlinks as what they point to
+    self.color_symlink_as_referent = self.indicators['ln'] == 'target'
+    # Whether symlink targets need to be looked at
+    self.check_symlink_mode = self.is_colored('or') or (
+        self.is_colored('ex') and self.color_symlink_as_referent)
+
+  def is_colored(self, indicator):
+    return is_colored(self.indicators[indicator])
+
+  def suffix_code(self, name):
+    name = name.translate(ASCII_LOWER)
+    for suffix, code in self.suffixes:
+      if name.endswith(suffix):
+        return code
+    return None
+
+  def color(self, name, indicator):
+    """
+    The escape sequence starting the color of a file, or None.
+
+    Only plain files (fi) are colored by their name's suffix.
+    Like ls, suffixes ignore ASCII case, and the last one defined wins.
+    """
+
+    if not self.enabled:
+      return None
+    code = None
+    if indicator == 'fi':
+      code = self.suffix_code(name)
+    if code is None:
+      code = self.indicators[indicator]
+      if code is None:
+        return None
+    return self.indicators['lc'] + code + self.indicators['rc']
+
+  def git_mode_color(self, name, mode, has_children):
+    """
+    The color of a git tree entry, from its mode.
+
+    Trees, submodules, and paths that only exist as parents of other
+    entries are directories. Symlink targets aren't known, so
+    ln=target colors links as plain files.
+    """
+
+    if has_children or mode in (
+        arbo_sources.GIT_MODE_TREE, arbo_sources.GIT_MODE_GITLINK, ):
+      indicator = 'di'
+    elif mode == arbo_sources.GIT_MODE_SYMLINK \
+        and self.indicators['ln'] != 'target':
+      indicator = 'ln'
+    elif mode == arbo_sources.GIT_MODE_EXECUTABLE and self.is_colored('ex'):
+      indicator = 'ex'
+    else:
+      indicator = 'fi'
+    return self.color(name, indicator)
+
+  def stat_indicator(self, path):
+    """
+    Classify a file the way ls picks its color, from lstat.
+
+    Returns an indicator (di, ln, ex, etc.), or None if path can't be
+    looked at. Special types only win when they have a color;
+    the order of the checks is the one ls uses.
+    """
+
+    try:
+      st = os.lstat(path)
+    except OSError:
+      return None
+    mode = st.st_mode
+    link_ok = False
+    if stat.S_ISLNK(mode) and self.check_symlink_mode:
+      try:
+        target_mode = os.stat(path).st_mode
+      except OSError:
+        pass
+      else:
+        link_ok = True
+        if self.color_symlink_as_referent:
+          mode = target_mode
+
+    if stat.S_ISREG(mode):
+      if mode & stat.S_ISUID and self.is_colored('su'):
+        indicator = 'su'
+      elif mode & stat.S_ISGID and self.is_colored('sg'):
+        indicator = 'sg'
+      elif self.is_colored('ca') and has_capability(path):
+        indicator = 'ca'
+      elif mode & 0o111 and self.is_colored('ex'):
+        indicator = 'ex'
+      elif st.st_nlink > 1 and self.is_colored('mh'):
+        indicator = 'mh'
+      else:
+        indicator = 'fi'
+    elif stat.S_ISDIR(mode):
+      if mode & stat.S_ISVTX and mode & stat.S_IWOTH \
+          and self.is_colored('tw'):
+        indicator = 'tw'
+      elif mode & stat.S_IWOTH and self.is_colored('ow'):
+        indicator = 'ow'
+      elif mode & stat.S_ISVTX and self.is_colored('st'):
+        indicator = 'st'
+      else:
+        indicator = 'di'
+    elif stat.S_ISLNK(mode):
+      indicator = 'ln'
+    elif stat.S_ISFIFO(mode):
+      indicator = 'pi'
+    elif stat.S_ISSOCK(mode):
+      indicator = 'so'
+    elif stat.S_ISBLK(mode):
+      indicator = 'bd'
+    elif stat.S_ISCHR(mode):
+      indicator = 'cd'
+    elif stat.S_ISDOOR(mode):
+      indicator = 'do'
+    else:
+      indicator = 'or'
+
+    if indicator == 'ln' and not link_ok and (
+        self.color_symlink_as_referent or self.is_colored('or')):
+      indicator = 'or'
+    return indicator
+
+  def path_color(self, path, name):
+    """
+    The color of the file at path, named name, as ls would show it.
+
+    None for files that have no color, or can't be looked at.
+    """
+
+    if not self.enabled:
+      return None
+    indicator = self.stat_indicator(path)
+    if indicator is None:
+      return None
+    return self.color(name, indicator)
+
+
+def known_term_type():
+  if os.environ.get('COLORTERM'):
+    return True
+  term = os.environ.get('TERM')
+  if not term:
+    return False
+  return any(fnmatch.fnmatchcase(term, pattern) for pattern in KNOWN_TERMS)
+
+
+def has_capability(path):
+  try:
+    return bool(os.getxattr(
+        path, 'security.capability', follow_symlinks=False))
+  except (AttributeError, OSError):
+    return False
+
+
+def quote_escape(name, encoding='utf-8', locale_encoding=None):
+  """
+  Quote a file name the way ls --quoting-style=escape does.
+
+  Spaces, backslashes and control characters get backslash escapes;
+  other unprintable characters get octal ones, byte by byte in the
+  locale's encoding. So do bytes that weren't valid in that encoding,
+  kept as surrogates. Unlike Python, C counts all spaces, format and
+  private use characters as printable.
+  Names are decoded with encoding; locale_encoding is the C library's
+  idea of the locale, which differs in Python's UTF-8 mode.
+  """
+
+  if UNQUOTED_RE.match(name):
+    return name
+  if locale_encoding is not None and locale_encoding != encoding:
+    name = name.encode(encoding, 'surrogateescape').decode(
+        locale_encoding, 'surrogateescape')
+    encoding = locale_encoding
+  parts = []
+  for char in name:
+    escape = QUOTE_ESCAPES.get(char)
+    if escape is not None:
+      parts.append(escape)
+    elif '\udc80' <= char <= '\udcff':
+      parts.append('\\%03o' % (ord(char) - 0xdc00))
+    elif unicodedata.category(char) in UNPRINTABLE_CATEGORIES:
+      parts.extend(
+          '\\%03o' % byte
+          for byte in char.encode(encoding, 'surrogateescape'))
+    else:
+      parts.append(char)
+  return ''.join(parts)
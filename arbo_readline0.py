@@ -2,36 +2,34 @@
 import sys
 
 def readline0(file=sys.stdin, separator='\0', blocksize=65536):
-	# this function assumes that there will be a null once in a while.  If you feed it with a huge block of data that has
-	# no nulls, woe betide you.
-	buffer = ''
-	fields = []
+	"""
+	Yield the separator-terminated records of a file.
+
+	Works on text and binary files; a str separator is encoded
+	as ASCII for binary files.  Each block is split once, and its
+	unterminated tail is kept aside.  A record that spans blocks is kept
+	as a list of pieces, joined once when its end shows up, so very long
+	records cost no more than short ones.  A last record without a
+	separator is yielded as well.
+	"""
+
+	read = getattr(file, 'read1', file.read)
+	pieces = []
 	while True:
-		block = file.read(blocksize)
-		if fields[0:]:
-			# nth time through loop, n>=2
-			if buffer[-1:] == separator:
-				# buffer ended in a null byte, so we need to yield a null string, and buffer is the block
-				if not block:
-					break
-				else:
-					buffer = block
-			else:
-				# buffer did not end in a null byte, so we have a partial element to return that needs to be saved
-				if not block:
-					yield fields[-1]
-					break
-				else:
-					buffer = fields[-1] + block
-		else:
-			# first time through the loop - an empty block is an empty input
-			# a nonempty block is something to part out
-			if not block:
-				break
-			else:
-				buffer = block
-		fields = buffer.split(separator)
-		for field in fields[:-1]:
+		block = read(blocksize)
+		if not block:
+			break
+		if not isinstance(block, str) and isinstance(separator, str):
+			separator = separator.encode('ascii')
+		fields = block.split(separator)
+		if pieces and len(fields) > 1:
+			pieces.append(fields[0])
+			fields[0] = block[:0].join(pieces)
+			pieces = []
+		tail = fields.pop()
+		for field in fields:
 			yield field
-	raise StopIteration
-
+		if tail:
+			pieces.append(tail)
+	if pieces:
+		yield pieces[0][:0].join(pieces)
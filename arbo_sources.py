@@ -0,0 +1,782 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+"""
+Path sources that run in-process, rather than through another command.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import concurrent.futures
+import errno
+import glob
+import os
+import struct
+import sys
+import urllib.parse
+
+# How many directories to read at once
+DEFAULT_WALK_THREADS = 16
+
+# What marks the top of a checkout, checked in this order in each directory
+VCS_MARKERS = (
+  ('.git', 'git'),
+  ('.hg', 'hg'),
+  ('_darcs', 'darcs'),
+  ('.fslckout', 'fossil'),
+  ('_FOSSIL_', 'fossil'),
+  ('.bzr', 'bzr'),
+  ('.svn', 'svn'),
+  ('CVS', 'cvs'),
+)
+
+# Git index extensions are optional when their name starts with A to Z
+GIT_INDEX_SIGNATURE = b'DIRC'
+GIT_INDEX_VERSIONS = (2, 3, 4, )
+GIT_HASH_SIZES = {'sha1': 20, 'sha256': 32, }
+# Entry fields before the hash: ctime, mtime (seconds, nanoseconds),
+# dev, ino, mode, uid, gid, size
+GIT_ENTRY_STAT_SIZE = 40
+GIT_FLAG_EXTENDED = 0x4000
+GIT_FLAG_NAME_MASK = 0xfff
+# Git tree entry modes
+GIT_MODE_TREE = 0o040000
+GIT_MODE_EXECUTABLE = 0o100755
+GIT_MODE_SYMLINK = 0o120000
+GIT_MODE_GITLINK = 0o160000
+
+# Fossil keeps its checkout state in one of these, at the checkout root
+FOSSIL_CHECKOUT_DBS = ('.fslckout', '_FOSSIL_', )
+
+# Mercurial's dirstate, in the v1 format: both parents, then entries of
+# state, mode, size, mtime, name length and name (plus any copy source)
+HG_DIRSTATE_HEADER_SIZE = 40
+HG_DIRSTATE_ENTRY = struct.Struct('>cllll')
+# States of tracked files: normal, added, merged (not removed)
+HG_TRACKED_STATES = (b'n', b'a', b'm', )
+# dirstate-v2: .hg/dirstate is a docket pointing to a data file holding
+# a tree of nodes
+HG_DIRSTATE_V2_REQUIREMENT = 'dirstate-v2'
+HG_DOCKET_MARKER = b'dirstate-v2\n'
+# Marker, both parents, the tree metadata (starting with the root
+# nodes' offset and count), then the data size
+HG_DOCKET_HEADER = struct.Struct('>12s32s32sII36xIB')
+# Path start and length, base name start, copy source start and length,
+# children offset and count, two counts, flags, size and mtime
+HG_NODE = struct.Struct('>IHHIHIIIIHIII')
+HG_NODE_WDIR_TRACKED = 1 << 0
+
+# Where svn 1.7 and later keep the state of a working copy
+SVN_ADMIN_DIR = '.svn'
+SVN_WC_DB = 'wc.db'
+
+# dpkg's database; DPKG_ADMINDIR overrides it, as it does for dpkg
+DPKG_ADMIN_DIR = '/var/lib/dpkg'
+
+# source is a subcommand name; root is the checkout (or bare repository)
+# git_dir is only set inside a git repository's own directory.
+Repo = collections.namedtuple('Repo', 'source root git_dir bare')
+
+
+def scan_dir(path):
+  """
+  List a directory, sorted by name, without following symlinks.
+
+  Returns (name, path, is_dir) tuples.
+  Unreadable directories are reported like find does, and look empty.
+  """
+
+  try:
+    with os.scandir(path) as it:
+      entries = list(it)
+  except OSError as err:
+    sys.stderr.write('arbo: %s: %s\n' % (path, err.strerror))
+    return []
+
+  listing = [
+      (entry.name, entry.path, entry.is_dir(follow_symlinks=False))
+      for entry in entries]
+  listing.sort(key=lambda item: item[0])
+  return listing
+
+
+def walk_preorder(top='.', threads=DEFAULT_WALK_THREADS, read_dir=scan_dir):
+  """
+  Walk the tree below top, like find does.
+
+  Yields (depth, name, is_dir) in preorder; children of top have depth 1.
+  read_dir lists a directory the way scan_dir does; directories it
+  returns None for are walked as empty.
+  As soon as a directory's listing is used, its subdirectories are
+  queued for reading in a thread pool, so reads on slow filesystems
+  overlap while the walk goes on in order.
+  """
+
+  with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+
+    def prefetch(listing):
+      return iter([
+        (name, is_dir, pool.submit(read_dir, path) if is_dir else None)
+        for name, path, is_dir in listing or ()])
+
+    stack = [prefetch(read_dir(top))]
+    while stack:
+      entry = next(stack[-1], None)
+      if entry is None:
+        stack.pop()
+        continue
+      name, is_dir, future = entry
+      yield len(stack), name, is_dir
+      if future is not None:
+        stack.append(prefetch(future.result()))
+
+
+def is_git_dir(path):
+  return (os.path.isfile(os.path.join(path, 'HEAD'))
+      and os.path.isdir(os.path.join(path, 'objects'))
+      and os.path.isdir(os.path.join(path, 'refs')))
+
+
+def git_config_value(git_dir, section, key):
+  """
+  Read a value from a repository's config file, without running git.
+
+  Only handles plain [section] headers, which is all we look up.
+  Returns None when unset.
+  """
+
+  section = section.lower()
+  key = key.lower()
+  current = None
+  try:
+    with open(os.path.join(git_dir, 'config'), errors='surrogateescape') as f:
+      for line in f:
+        line = line.strip()
+        if line.startswith('['):
+          current = line.strip('[]').strip().lower()
+        elif current == section and '=' in line:
+          name, value = line.split('=', 1)
+          if name.strip().lower() == key:
+            return value.strip()
+  except (IOError, OSError):
+    pass
+  return None
+
+
+def git_config_is_bare(git_dir):
+  value = git_config_value(git_dir, 'core', 'bare')
+  return value is not None and value.lower() in ('true', 'yes', 'on', '1')
+
+
+def find_repo(start=None):
+  """
+  Find the checkout containing start, looking for VCS_MARKERS upwards.
+
+  Returns a Repo, or None outside of any checkout.
+  The nearest marker wins, so nested checkouts are handled.
+  """
+
+  path = os.path.abspath(start or os.getcwd())
+  while True:
+    if is_git_dir(path):
+      if os.path.basename(path) == '.git' and not git_config_is_bare(path):
+        return Repo('git', os.path.dirname(path), path, False)
+      return Repo('git', path, path, True)
+    for marker, source in VCS_MARKERS:
+      if os.path.lexists(os.path.join(path, marker)):
+        return Repo(source, path, None, False)
+    parent = os.path.dirname(path)
+    if parent == path:
+      return None
+    path = parent
+
+
+class Unsupported(Exception):
+  """
+  A source can't be read in-process; its command has to be run.
+  """
+
+
+class UnsupportedIndex(Unsupported):
+  """
+  The index uses something we can't read; git ls-files can.
+  """
+
+
+def find_git_dir(work_tree):
+  """
+  Return the git directory of a work tree, following gitfiles.
+
+  Returns (git_dir, common_dir); they differ for linked work trees.
+  """
+
+  git_dir = os.path.join(work_tree, '.git')
+  if os.path.isfile(git_dir):
+    try:
+      with open(git_dir, errors='surrogateescape') as f:
+        line = f.readline().rstrip('\n')
+    except (IOError, OSError) as err:
+      raise UnsupportedIndex('Unreadable gitfile', git_dir, err)
+    if not line.startswith('gitdir: '):
+      raise UnsupportedIndex('Not a gitfile', git_dir)
+    git_dir = os.path.join(work_tree, line[len('gitdir: '):])
+  common_dir = git_dir
+  try:
+    with open(os.path.join(git_dir, 'commondir'), errors='surrogateescape') as f:
+      common_dir = os.path.join(git_dir, f.readline().rstrip('\n'))
+  except (IOError, OSError):
+    pass
+  return git_dir, common_dir
+
+
+def read_git_index(index_path, hash_size=GIT_HASH_SIZES['sha1']):
+  """
+  Read the entries of a git index file, versions 2 to 4.
+
+  Returns (path, mode) pairs in index order, paths as bytes.
+  Raises UnsupportedIndex on a required extension (split or sparse
+  indexes), or on anything unexpected.
+  """
+
+  try:
+    with open(index_path, 'rb') as f:
+      data = f.read()
+  except (IOError, OSError) as err:
+    if err.errno == errno.ENOENT:
+      # A fresh repository, nothing added yet
+      return []
+    raise UnsupportedIndex('Unreadable index', index_path, err)
+  if len(data) < 12 + hash_size or data[:4] != GIT_INDEX_SIGNATURE:
+    raise UnsupportedIndex('Not an index', index_path)
+  version, count = struct.unpack_from('>II', data, 4)
+  if version not in GIT_INDEX_VERSIONS:
+    raise UnsupportedIndex('Index version', version)
+
+  entries = []
+  pos = 12
+  path = b''
+  mode_offset = 24
+  flags_offset = GIT_ENTRY_STAT_SIZE + hash_size
+  try:
+    for i in range(count):
+      start = pos
+      mode, = struct.unpack_from('>I', data, start + mode_offset)
+      flags, = struct.unpack_from('>H', data, start + flags_offset)
+      pos = start + flags_offset + 2
+      if flags & GIT_FLAG_EXTENDED:
+        pos += 2
+      if version == 4:
+        # Remove that many bytes from the previous path,
+        # then append a NUL-terminated suffix
+        byte = data[pos]
+        pos += 1
+        strip = byte & 0x7f
+        while byte & 0x80:
+          byte = data[pos]
+          pos += 1
+          strip = ((strip + 1) << 7) | (byte & 0x7f)
+        end = data.index(b'\0', pos)
+        path = path[:len(path) - strip] + data[pos:end]
+        pos = end + 1
+      else:
+        end = data.index(b'\0', pos)
+        path = data[pos:end]
+        # NUL padding to a multiple of 8 bytes, at least one
+        pos = start + ((end - start + 8) & ~7)
+      # The flags hold the name's length, unless it is too long to fit
+      name_len = flags & GIT_FLAG_NAME_MASK
+      if name_len != GIT_FLAG_NAME_MASK and name_len != len(path):
+        raise UnsupportedIndex('Name length', index_path, path)
+      entries.append((path, mode))
+  except (IndexError, ValueError, struct.error):
+    raise UnsupportedIndex('Truncated index', index_path)
+
+  end = len(data) - hash_size
+  while pos + 8 <= end:
+    signature = data[pos:pos + 4]
+    size, = struct.unpack_from('>I', data, pos + 4)
+    if not b'A' <= signature[:1] <= b'Z':
+      raise UnsupportedIndex('Required index extension', signature)
+    pos += 8 + size
+  return entries
+
+
+def git_index_paths(work_tree, start=None):
+  """
+  List what git ls-files -z would, from the index of a work tree.
+
+  Returns (path, mode) pairs for paths below start (by default, the
+  current directory), relative to it, in index order.
+  Raises UnsupportedIndex when git ls-files should be used instead.
+  """
+
+  for var in ('GIT_DIR', 'GIT_WORK_TREE', 'GIT_INDEX_FILE', ):
+    if var in os.environ:
+      raise UnsupportedIndex('Environment overrides', var)
+  git_dir, common_dir = find_git_dir(work_tree)
+  object_format = git_config_value(common_dir, 'extensions', 'objectformat')
+  hash_size = GIT_HASH_SIZES.get((object_format or 'sha1').lower())
+  if hash_size is None:
+    raise UnsupportedIndex('Object format', object_format)
+  entries = read_git_index(os.path.join(git_dir, 'index'), hash_size)
+
+  prefix = os.path.relpath(os.path.abspath(start or os.getcwd()), work_tree)
+  if prefix == os.curdir:
+    prefix = b''
+  else:
+    prefix = os.fsencode(prefix) + b'/'
+  paths = []
+  path0 = None
+  for path, mode in entries:
+    # Unmerged paths have an entry per stage
+    if path == path0 or not path.startswith(prefix):
+      continue
+    path0 = path
+    paths.append((os.fsdecode(path[len(prefix):]), mode))
+  return paths
+
+
+def find_marker(names, start=None):
+  """
+  Find the nearest directory, from start upwards, containing one of names.
+
+  Returns (directory, path of the marker), or (None, None).
+  """
+
+  path = os.path.abspath(start or os.getcwd())
+  while True:
+    for name in names:
+      marker = os.path.join(path, name)
+      if os.path.lexists(marker):
+        return path, marker
+    parent = os.path.dirname(path)
+    if parent == path:
+      return None, None
+    path = parent
+
+
+def query_sqlite(db_path, query):
+  """
+  Run a query on a database opened read-only, returning all rows.
+
+  Text comes back decoded like file names are.
+  Raises Unsupported when sqlite3 is missing or the query fails.
+  """
+
+  try:
+    import sqlite3
+  except ImportError:
+    raise Unsupported('No sqlite3 module')
+  try:
+    db = sqlite3.connect(
+        'file:%s?mode=ro' % urllib.parse.quote(db_path), uri=True)
+    try:
+      db.text_factory = os.fsdecode
+      return db.execute(query).fetchall()
+    finally:
+      db.close()
+  except sqlite3.Error as err:
+    raise Unsupported('Unreadable database', db_path, err)
+
+
+def fossil_checkout_paths(start=None):
+  """
+  List the files of the fossil checkout containing start, from its database.
+
+  Returns (root, paths); paths are relative to root, and leave
+  out files marked deleted. Below the checkout's top, only the files
+  below start are listed, and root is start.
+  Raises Unsupported outside of a checkout, or when the database
+  can't be read.
+  """
+
+  start = os.path.abspath(start or os.getcwd())
+  root, db_path = find_marker(FOSSIL_CHECKOUT_DBS, start)
+  if root is None:
+    raise Unsupported('Not in a fossil checkout')
+  paths = [row[0] for row in query_sqlite(db_path,
+      'SELECT pathname FROM vfile'
+      ' WHERE vid = (SELECT value FROM vvar WHERE name = \'checkout\')'
+      ' AND NOT deleted')]
+
+  prefix = os.path.relpath(start, root)
+  if prefix == os.curdir:
+    return root, paths
+  prefix += '/'
+  return start, [path[len(prefix):] for path in paths
+      if path.startswith(prefix)]
+
+
+def dpkg_info_dir():
+  return os.path.join(os.environ.get('DPKG_ADMINDIR', DPKG_ADMIN_DIR), 'info')
+
+
+def dpkg_installed_arch(name):
+  """
+  Read the architecture of an installed package from dpkg's status file.
+
+  Returns None when the package isn't installed.
+  """
+
+  path = os.path.join(
+      os.environ.get('DPKG_ADMINDIR', DPKG_ADMIN_DIR), 'status')
+  try:
+    with open(path, encoding='utf-8', errors='surrogateescape') as status:
+      # Stanzas are separated by blank lines; continuation lines
+      # start with a space and are never the fields we look at
+      fields = {}
+      for line in status:
+        if line.strip():
+          key, sep, value = line.partition(':')
+          if sep and not key.startswith((' ', '\t')):
+            fields[key] = value.strip()
+          continue
+        if (fields.get('Package') == name
+            and fields.get('Status', '').endswith(' installed')):
+          return fields.get('Architecture')
+        fields = {}
+  except OSError as err:
+    raise Unsupported('No dpkg database', path, err)
+  if (fields.get('Package') == name
+      and fields.get('Status', '').endswith(' installed')):
+    return fields.get('Architecture')
+  return None
+
+
+def find_dpkg_lists(packages):
+  """
+  Find the file lists of installed packages.
+
+  Without an architecture qualifier, every installed architecture
+  of a Multi-Arch: same package is found.
+  Returns (package, list path) pairs.
+  Raises Unsupported when a package isn't installed, so that dpkg
+  can say so.
+  """
+
+  info_dir = dpkg_info_dir()
+  lists = []
+  for package in packages:
+    path = os.path.join(info_dir, package + '.list')
+    if os.path.isfile(path):
+      lists.append((package, path))
+      continue
+    name, sep, arch = package.partition(':')
+    if sep:
+      # Only Multi-Arch: same packages have the qualifier in their name;
+      # the unqualified list is the one of the installed architecture
+      path = os.path.join(info_dir, name + '.list')
+      found = [path] if os.path.isfile(path) and (
+          dpkg_installed_arch(name) in (arch, 'all')) else []
+    else:
+      found = sorted(glob.glob(os.path.join(
+          glob.escape(info_dir), glob.escape(name) + ':*.list')))
+    if not found:
+      raise Unsupported('Package not installed', package)
+    lists.extend(
+        (os.path.basename(path)[:-len('.list')], path) for path in found)
+  return lists
+
+
+def all_dpkg_lists():
+  """
+  Find the file lists of all installed packages, sorted by package.
+  """
+
+  info_dir = dpkg_info_dir()
+  try:
+    names = sorted(os.listdir(info_dir))
+  except OSError as err:
+    raise Unsupported('No dpkg database', info_dir, err)
+  return [(name[:-len('.list')], os.path.join(info_dir, name))
+          for name in names if name.endswith('.list')]
+
+
+def read_dpkg_list(path):
+  """
+  Read the paths of one package's list.
+
+  The /. entry every package has is left out.
+  """
+
+  with open(path, 'rb') as f:
+    data = f.read()
+  return [os.fsdecode(line) for line in data.split(b'\n')
+          if line and line != b'/.']
+
+
+def dpkg_package_paths(lists, threads=DEFAULT_WALK_THREADS):
+  """
+  Read package lists from (package, list path) pairs, in a thread pool.
+
+  Returns (package, paths) pairs, in the same order.
+  """
+
+  with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+    return list(zip(
+        [package for package, path in lists],
+        pool.map(read_dpkg_list, [path for package, path in lists])))
+
+
+def svn_wc_paths(start=None):
+  """
+  List what svn list -R would, from the working copy's database.
+
+  Works offline: the working copy's nodes are listed rather than the
+  repository's. Directories are included, like svn list does.
+  Returns paths below start, relative to it, in no particular order.
+  Raises Unsupported outside of an svn 1.7+ working copy, or when
+  its database can't be read.
+  """
+
+  start = os.path.abspath(start or os.getcwd())
+  root, admin_dir = find_marker((SVN_ADMIN_DIR, ), start)
+  if root is None:
+    raise Unsupported('Not in an svn working copy')
+  db_path = os.path.join(admin_dir, SVN_WC_DB)
+  if not os.path.isfile(db_path):
+    raise Unsupported('No working copy database', db_path)
+  # Each path has a row per layer of local changes (op_depth);
+  # the highest one says what the working copy has now.
+  rows = query_sqlite(db_path,
+      'SELECT local_relpath FROM nodes AS n'
+      ' WHERE op_depth = (SELECT MAX(op_depth) FROM nodes'
+      '   WHERE wc_id = n.wc_id AND local_relpath = n.local_relpath)'
+      ' AND presence IN (\'normal\', \'incomplete\')'
+      ' AND local_relpath != \'\'')
+
+  prefix = os.path.relpath(start, root)
+  if prefix == os.curdir:
+    return [row[0] for row in rows]
+  prefix += '/'
+  return [row[0][len(prefix):] for row in rows if row[0].startswith(prefix)]
+
+
+def read_hg_dirstate_v1(data):
+  """
+  Return the tracked paths of a v1 dirstate, as bytes, in no order.
+  """
+
+  paths = []
+  pos = HG_DIRSTATE_HEADER_SIZE
+  entry_size = HG_DIRSTATE_ENTRY.size
+  unpack_from = HG_DIRSTATE_ENTRY.unpack_from
+  try:
+    while pos < len(data):
+      state, mode, size, mtime, length = unpack_from(data, pos)
+      pos += entry_size
+      if state in HG_TRACKED_STATES:
+        # The copy source follows a NUL
+        paths.append(data[pos:pos + length].split(b'\0', 1)[0])
+      pos += length
+  except struct.error:
+    raise Unsupported('Truncated dirstate')
+  if pos != len(data):
+    raise Unsupported('Truncated dirstate')
+  return paths
+
+
+def read_hg_dirstate_v2(hg_dir, docket):
+  """
+  Return the tracked paths of a dirstate-v2, as bytes, in no order.
+  """
+
+  try:
+    (marker, p1, p2, root_start, root_count, data_size,
+     uuid_size) = HG_DOCKET_HEADER.unpack_from(docket)
+  except struct.error:
+    raise Unsupported('Truncated dirstate docket')
+  uuid = docket[HG_DOCKET_HEADER.size:HG_DOCKET_HEADER.size + uuid_size]
+  if marker != HG_DOCKET_MARKER or len(uuid) != uuid_size:
+    raise Unsupported('Not a dirstate docket')
+  data_path = os.path.join(hg_dir, 'dirstate.' + os.fsdecode(uuid))
+  try:
+    with open(data_path, 'rb') as f:
+      data = f.read(data_size)
+  except (IOError, OSError) as err:
+    # Rotated away by a concurrent hg write, or unreadable
+    raise Unsupported('Unreadable dirstate data', data_path, err)
+  if len(data) != data_size:
+    raise Unsupported('Truncated dirstate data', data_path)
+
+  paths = []
+  node_size = HG_NODE.size
+  unpack_from = HG_NODE.unpack_from
+  # Ranges of sibling nodes; only nodes reachable from the root count,
+  # the data file may hold stale ones
+  stack = [(root_start, root_count)]
+  try:
+    while stack:
+      start, count = stack.pop()
+      for pos in range(start, start + count * node_size, node_size):
+        (path_start, path_len, base_start, copy_start, copy_len,
+         children_start, children_count, with_entry, tracked,
+         flags, size, mtime_s, mtime_ns) = unpack_from(data, pos)
+        if flags & HG_NODE_WDIR_TRACKED:
+          paths.append(data[path_start:path_start + path_len])
+        if children_count:
+          stack.append((children_start, children_count))
+  except struct.error:
+    raise Unsupported('Truncated dirstate data', data_path)
+  return paths
+
+
+def hg_dirstate_paths(start=None):
+  """
+  List what hg locate would, from the dirstate of the enclosing checkout.
+
+  Returns (root, paths); paths are relative to root, restricted to
+  those below start, in no particular order.
+  Raises Unsupported outside of a checkout, or on a dirstate
+  we can't read.
+  """
+
+  start = os.path.abspath(start or os.getcwd())
+  root, hg_dir = find_marker(('.hg', ), start)
+  if root is None:
+    raise Unsupported('Not in an hg checkout')
+  try:
+    with open(os.path.join(hg_dir, 'requires'), errors='surrogateescape') as f:
+      requires = f.read().split()
+  except (IOError, OSError):
+    requires = []
+  try:
+    with open(os.path.join(hg_dir, 'dirstate'), 'rb') as f:
+      data = f.read()
+  except (IOError, OSError) as err:
+    if err.errno == errno.ENOENT:
+      # Nothing checked out yet
+      return root, []
+    raise Unsupported('Unreadable dirstate', hg_dir, err)
+  if data.startswith(HG_DOCKET_MARKER):
+    paths = read_hg_dirstate_v2(hg_dir, data)
+  elif HG_DIRSTATE_V2_REQUIREMENT in requires:
+    raise Unsupported('Not a dirstate docket')
+  else:
+    paths = read_hg_dirstate_v1(data)
+
+  prefix = os.path.relpath(start, root)
+  if prefix == os.curdir:
+    return root, [os.fsdecode(path) for path in paths]
+  prefix = os.fsencode(prefix) + b'/'
+  return root, [os.fsdecode(path) for path in paths if path.startswith(prefix)]
+
+
+def parse_cvs_entry(line):
+  """
+  Return the name and revision of a CVS/Entries file line.
+
+  File lines look like /name/revision/timestamp/options/tagdate;
+  anything else (directories, blank lines) gives (None, None).
+  """
+
+  if line[:1] != b'/':
+    return None, None
+  fields = line.split(b'/')
+  if len(fields) < 3:
+    return None, None
+  return os.fsdecode(fields[1]), fields[2]
+
+
+def read_cvs_dir(path):
+  """
+  Read what CVS knows about a directory, and what is in it.
+
+  Returns (name, path, is_dir) for live versioned files that exist,
+  and for subdirectories other than CVS, sorted by name.
+  Returns None if path isn't part of a CVS checkout.
+  """
+
+  admin_dir = os.path.join(path, 'CVS')
+  try:
+    with open(os.path.join(admin_dir, 'Entries'), 'rb') as f:
+      lines = f.read().split(b'\n')
+  except (IOError, OSError):
+    return None
+  try:
+    with open(os.path.join(admin_dir, 'Entries.Log'), 'rb') as f:
+      log = f.read().split(b'\n')
+  except (IOError, OSError):
+    log = []
+
+  revisions = {}
+  for line in lines:
+    name, revision = parse_cvs_entry(line)
+    if name is not None:
+      revisions[name] = revision
+  # Changes not yet folded into Entries: A adds a line, R removes one
+  for line in log:
+    name, revision = parse_cvs_entry(line[2:])
+    if name is None:
+      continue
+    if line[:2] == b'A ':
+      revisions[name] = revision
+    elif line[:2] == b'R ':
+      revisions.pop(name, None)
+
+  children = []
+  for name, child_path, is_dir in scan_dir(path):
+    if is_dir:
+      if name != 'CVS':
+        children.append((name, child_path, True))
+    else:
+      revision = revisions.get(name)
+      # Removed files have their revision negated
+      if revision and not revision.startswith(b'-'):
+        children.append((name, child_path, False))
+  return children
+
+
+def cvs_checkout_paths(top='.', threads=DEFAULT_WALK_THREADS):
+  """
+  List the files of a CVS checkout, like cvsu --find --types=AFGM.
+
+  That is the versioned files that exist and aren't being removed.
+  Returns an iterator of paths relative to top, in path order.
+  Directories are read by walk_preorder, with read_cvs_dir;
+  those that aren't checked out aren't listed.
+  Raises Unsupported if top isn't part of a CVS checkout.
+  """
+
+  if not os.path.isfile(os.path.join(top, 'CVS', 'Entries')):
+    raise Unsupported('Not in a CVS checkout')
+  return preorder_file_paths(walk_preorder(top, threads, read_cvs_dir))
+
+
+def preorder_file_paths(entries):
+  """
+  Turn walk_preorder entries into the paths of the files, relative to top.
+  """
+
+  prefixes = ['']
+  for depth, name, is_dir in entries:
+    del prefixes[depth:]
+    if is_dir:
+      prefixes.append(prefixes[-1] + name + '/')
+    else:
+      yield prefixes[-1] + name
+
+
+def checkout_paths(repo):
+  """
+  List the files of a checkout in-process, relative to its root.
+
+  Returns (path, mode) pairs; modes are only known for git, and are
+  None for other sources.
+  Raises Unsupported when the checkout's own command has to be run.
+  """
+
+  if repo.bare:
+    raise Unsupported('Bare repository', repo.root)
+  if repo.source == 'git':
+    return git_index_paths(repo.root, repo.root)
+  if repo.source == 'hg':
+    root, paths = hg_dirstate_paths(repo.root)
+  elif repo.source == 'fossil':
+    root, paths = fossil_checkout_paths(repo.root)
+  elif repo.source == 'svn':
+    paths = svn_wc_paths(repo.root)
+  elif repo.source == 'cvs':
+    paths = list(cvs_checkout_paths(repo.root))
+  else:
+    raise Unsupported('No in-process reader', repo.source)
+  return [(path, None) for path in paths]
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+"""
+Time colorizing a directory tree with a growing number of ls processes,
+and in-process.
+
+Usage: bench/bench_colorize.py [DIRECTORY [MAX_PROCESSES]]
+"""
+
+from __future__ import absolute_import
+
+import functools
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo
+import arbo_lscolors
+import arbo_sources
+
+
+def timed_display(colorizer):
+  # Colorizing replaces node values, so each run needs a fresh tree
+  tree = arbo.tree_from_walk()
+  out = arbo.ByteWriter(os.open(os.devnull, os.O_WRONLY), 'utf-8')
+  start = time.perf_counter()
+  arbo.display_tree(tree, out, wide=False, colorize=True, colorizer=colorizer)
+  out.flush()
+  return time.perf_counter() - start
+
+
+def main():
+  top = sys.argv[1] if sys.argv[1:] else '/usr'
+  max_processes = int(sys.argv[2]) if sys.argv[2:] else os.cpu_count()
+  os.chdir(top)
+  paths = sum(1 for entry in arbo_sources.walk_preorder('.'))
+
+  print('%s, %d paths, %d cores' % (top, paths, os.cpu_count()))
+  processes = 1
+  while processes <= max_processes:
+    elapsed = timed_display(functools.partial(
+        arbo.colorize_nt_iter, processes=processes))
+    print('ls, %-3d at once  %6.2fs' % (processes, elapsed))
+    processes *= 2
+  elapsed = timed_display(functools.partial(
+      arbo.colorize_nt_iter_lstat,
+      ls_colors=arbo_lscolors.LsColors(), encoding='utf-8'))
+  print('in-process       %6.2fs' % elapsed)
+
+
+if __name__ == '__main__':
+  sys.exit(main())
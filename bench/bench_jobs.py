@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+"""
+Time tree building with a growing number of processes.
+
+Also shows the CPU time the parent process spends (grouping lines,
+sending them out, attaching the results), which workers can't take
+over; the serial time over it bounds the speedup, however many cores.
+
+Usage: bench/bench_jobs.py [PATH_COUNT [MAX_JOBS]]
+"""
+
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo
+from bench_memory import make_paths
+
+
+def timed_build(paths, jobs):
+  start = time.perf_counter()
+  start_cpu = time.process_time()
+  if jobs == 1:
+    arbo.tree_from_line_iter(iter(paths), skip_dot=False)
+  else:
+    arbo.tree_from_line_iter_parallel(iter(paths), skip_dot=False, jobs=jobs)
+  return time.perf_counter() - start, time.process_time() - start_cpu
+
+
+def main():
+  count = int(sys.argv[1]) if sys.argv[1:] else 1000000
+  max_jobs = int(sys.argv[2]) if sys.argv[2:] else os.cpu_count()
+  paths = make_paths(count)
+
+  print('%d paths, %d cores' % (count, os.cpu_count()))
+  base = None
+  jobs = 1
+  while jobs <= max_jobs:
+    elapsed, parent_cpu = timed_build(paths, jobs)
+    if base is None:
+      base = elapsed
+    print('--jobs %-3d %6.2fs  x%.2f  parent CPU %.2fs, at most x%.1f' % (
+        jobs, elapsed, base / elapsed, parent_cpu, base / parent_cpu))
+    jobs *= 2
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+"""
+Measure how much memory a built tree takes, per node.
+
+Compares slotted Node objects (with interned values),
+the same tree built from a Node subclass that has a __dict__
+(as Node used to), and CompactTree.
+
+Usage: bench/bench_memory.py [PATH_COUNT]
+"""
+
+from __future__ import absolute_import
+
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo
+
+
+class DictNode(arbo.Node):
+  """
+  A Node with a __dict__, like before Node had __slots__.
+  """
+
+  def __init__(self, value):
+    # Don't let interning hide the cost of per-line strings
+    super(DictNode, self).__init__(''.join(value))
+
+
+def make_paths(count, seed=0):
+  """
+  A sorted, monorepo-like listing with lots of repeated names.
+  """
+
+  rnd = random.Random(seed)
+  dirs = ['src', 'test', 'lib', 'docs', 'java', 'org', 'main', 'resources', ]
+  files = ['__init__.py', 'README', 'Makefile', 'index.js', 'setup.py', ]
+  paths = []
+  for i in range(count):
+    depth = rnd.randint(1, 6)
+    comps = ['%s%d' % (rnd.choice(dirs), rnd.randint(0, 9))
+             for j in range(depth)]
+    comps.append(rnd.choice(files))
+    paths.append('/'.join(comps))
+  paths.sort()
+  return paths
+
+
+def measure(build, paths):
+  tracemalloc.start()
+  tree = build(iter(paths), skip_dot=False)
+  size = tracemalloc.get_traced_memory()[0]
+  tracemalloc.stop()
+  return tree, size
+
+
+def count_nodes(tree):
+  return sum(1 for nt in tree.traverse_skip_root())
+
+
+def main():
+  count = int(sys.argv[1]) if sys.argv[1:] else 200000
+  paths = make_paths(count)
+
+  tree, size = measure(arbo.tree_from_line_iter, paths)
+  nodes = count_nodes(tree)
+  del tree
+  print('%d paths, %d nodes' % (count, nodes))
+  print('%-24s %6.1f bytes/node' % ('Node, slotted', size / nodes))
+
+  node_class = arbo.Node
+  arbo.Node = DictNode
+  try:
+    tree, size = measure(arbo.tree_from_line_iter, paths)
+  finally:
+    arbo.Node = node_class
+  del tree
+  print('%-24s %6.1f bytes/node' % ('Node with __dict__', size / nodes))
+
+  tree, size = measure(arbo.compact_tree_from_line_iter, paths)
+  del tree
+  print('%-24s %6.1f bytes/node' % ('CompactTree', size / nodes))
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+"""
+Compare readline0 throughput with its previous implementation.
+
+Corpora look like find -print0 and git ls-files -z output,
+plus one made of a few very long records.
+
+Usage: bench/bench_readline0.py [PATH_COUNT]
+"""
+
+from __future__ import absolute_import
+
+import collections
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from arbo_readline0 import readline0
+from bench_memory import make_paths
+
+
+def readline0_old(file=sys.stdin, separator='\0', blocksize=65536):
+  """
+  readline0 as it was, concatenating partial records to each block.
+  """
+
+  buffer = ''
+  fields = []
+  while True:
+    block = file.read(blocksize)
+    if fields[0:]:
+      if buffer[-1:] == separator:
+        if not block:
+          break
+        else:
+          buffer = block
+      else:
+        if not block:
+          yield fields[-1]
+          break
+        else:
+          buffer = fields[-1] + block
+    else:
+      if not block:
+        break
+      else:
+        buffer = block
+    fields = buffer.split(separator)
+    for field in fields[:-1]:
+      yield field
+
+
+def timed(make_file, split, **kwargs):
+  best = None
+  for i in range(3):
+    infile = make_file()
+    start = time.perf_counter()
+    collections.deque(split(infile, **kwargs), 0)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def main():
+  count = int(sys.argv[1]) if sys.argv[1:] else 500000
+  paths = make_paths(count)
+  corpora = [
+      ('find -print0', ''.join('./%s\0' % path for path in paths)),
+      ('git ls-files -z', ''.join('%s\0' % path for path in paths)),
+      ('long records', ''.join('x' * (1 << 22) + '\0' for i in range(8))),
+  ]
+
+  for name, text in corpora:
+    data = text.encode('utf-8')
+    size = len(data) / float(1 << 20)
+    print('%s, %.1f MiB' % (name, size))
+    for blocksize in (1 << 12, 1 << 16, 1 << 20):
+      old = timed(lambda: io.StringIO(text), readline0_old, blocksize=blocksize)
+      new = timed(lambda: io.StringIO(text), readline0, blocksize=blocksize)
+      new_bytes = timed(
+          lambda: io.BufferedReader(io.BytesIO(data)), readline0,
+          blocksize=blocksize)
+      print('  blocksize %-8d old %7.1f MiB/s  new %7.1f MiB/s  '
+            'new, bytes %7.1f MiB/s' % (
+              blocksize, size / old, size / new, size / new_bytes))
+
+
+if __name__ == '__main__':
+  sys.exit(main())
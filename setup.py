@@ -13,7 +13,9 @@ setup(name='arbo',
         +'all version-controlled files.\n',
       py_modules=[
            'arbo',
+           'arbo_lscolors',
            'arbo_readline0',
+           'arbo_sources',
            ],
      )
 
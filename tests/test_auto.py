@@ -0,0 +1,46 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ARBO = os.path.join(ROOT, 'arbo.py')
+sys.path.insert(0, ROOT)
+import arbo_sources
+
+# What the sources run when they can't list in-process
+COMMANDS = ('git', 'hg', 'darcs', 'fossil', 'bzr', 'svn', 'cvsu', )
+
+
+@pytest.fixture
+def empty_commands(tmp_path):
+  """
+  A PATH where the VCS commands succeed and list nothing.
+  """
+
+  bindir = tmp_path / 'bin'
+  bindir.mkdir()
+  for name in COMMANDS:
+    stub = bindir / name
+    stub.write_text('#!/bin/sh\n')
+    stub.chmod(0o755)
+  return str(bindir) + os.pathsep + os.environ['PATH']
+
+
+@pytest.mark.parametrize(
+    'marker,source', arbo_sources.VCS_MARKERS,
+    ids=[marker for marker, source in arbo_sources.VCS_MARKERS])
+def test_every_marker(tmp_path, empty_commands, marker, source):
+  checkout = tmp_path / 'checkout'
+  (checkout / marker).mkdir(parents=True)
+  assert arbo_sources.find_repo(str(checkout)).source == source
+  env = dict(os.environ, PATH=empty_commands)
+  proc = subprocess.run(
+      (sys.executable, ARBO, 'auto', ), cwd=str(checkout), env=env,
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  assert proc.returncode == 0, proc.stderr.decode()
+  assert proc.stderr == b''
@@ -0,0 +1,38 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo_sources
+
+# A checkout of a, b, gone, removed and sub/ (with c and d.txt),
+# after cvs add added logged, cvs rm b removed and rm gone.
+# Entries.Log holds the adds and the removal of b, not yet folded
+# into Entries; notcvs and the unversioned files were never added.
+CHECKOUT = os.path.join(os.path.dirname(__file__), 'fixtures', 'cvs-checkout')
+
+
+def test_checkout():
+  # What cvs ls -R lists that is still on disk and not being removed
+  assert list(arbo_sources.cvs_checkout_paths(CHECKOUT, threads=2)) == [
+      'a', 'added', 'logged/e', 'sub/c', 'sub/d.txt']
+
+
+def test_subdirectory():
+  assert list(arbo_sources.cvs_checkout_paths(
+      os.path.join(CHECKOUT, 'sub'))) == ['c', 'd.txt']
+
+
+def test_not_a_checkout():
+  with pytest.raises(arbo_sources.Unsupported):
+    arbo_sources.cvs_checkout_paths(os.path.join(CHECKOUT, 'notcvs'))
+
+
+def test_entries_log():
+  names = [
+      name for name, path, is_dir in arbo_sources.read_cvs_dir(CHECKOUT)]
+  assert names == ['a', 'added', 'logged', 'notcvs', 'sub']
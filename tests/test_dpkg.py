@@ -0,0 +1,59 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo
+import arbo_sources
+
+STATUS = '''\
+Package: bash
+Status: install ok installed
+Architecture: amd64
+Description: GNU Bourne Again SHell
+ Architecture: i386
+
+Package: tzdata
+Status: install ok installed
+Architecture: all
+
+Package: gone
+Status: deinstall ok config-files
+Architecture: amd64
+'''
+
+@pytest.fixture
+def admin_dir(tmp_path, monkeypatch):
+  (tmp_path / 'status').write_text(STATUS)
+  info = tmp_path / 'info'
+  info.mkdir()
+  for name in ('bash', 'tzdata', 'gone', 'libc6:amd64', 'libc6:i386'):
+    (info / (name + '.list')).write_text('/.\n')
+  monkeypatch.setenv('DPKG_ADMINDIR', str(tmp_path))
+  return info
+
+def names(packages):
+  return [name for name, path in arbo_sources.find_dpkg_lists(packages)]
+
+def test_qualified_matches_installed_arch(admin_dir):
+  assert names(['bash:amd64', 'tzdata:amd64', 'libc6:i386']) == [
+      'bash', 'tzdata', 'libc6:i386']
+  assert names(['libc6']) == ['libc6:amd64', 'libc6:i386']
+
+def test_qualified_other_arch(admin_dir):
+  for package in ('bash:i386', 'gone:amd64', 'missing:amd64'):
+    with pytest.raises(arbo_sources.Unsupported):
+      arbo_sources.find_dpkg_lists([package])
+
+def test_annotate_from_command(admin_dir):
+  # What dpkg -L prints, when its database can't be read in-process
+  (admin_dir / 'bash.list').write_text('/.\n/bin\n/bin/bash\n/usr\n')
+  (admin_dir / 'tzdata.list').write_text('/.\n/usr\n/usr/share/zoneinfo\n')
+  cmd = ['sh', '-c', 'cat "$DPKG_ADMINDIR/info/$0.list"']
+  expected = arbo.dpkg_lines(['bash', 'tzdata'], False)
+  assert arbo.dpkg_cmd_lines(cmd, ['bash', 'tzdata']) == expected
+  assert expected[1]['/usr'] == ['bash', 'tzdata']
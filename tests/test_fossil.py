@@ -0,0 +1,46 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo_sources
+
+# The vvar and vfile tables of a checkout of version 2, which has a,
+# doc/README, src.txt, src/main.c and src/lib/util.c, after fossil rm
+# gone src/removed.c. Version 1's rows (a, old, src/main.c) are left
+# from the previous checkout.
+FIXTURE = os.path.join(
+    os.path.dirname(__file__), 'fixtures', 'fossil-checkout.db')
+
+
+@pytest.fixture(params=arbo_sources.FOSSIL_CHECKOUT_DBS)
+def checkout(request, tmp_path):
+  shutil.copyfile(FIXTURE, str(tmp_path / request.param))
+  (tmp_path / 'src' / 'lib').mkdir(parents=True)
+  return tmp_path
+
+
+def test_root(checkout):
+  root, paths = arbo_sources.fossil_checkout_paths(str(checkout))
+  assert root == str(checkout)
+  assert sorted(paths) == [
+      'a', 'doc/README', 'src.txt', 'src/lib/util.c', 'src/main.c']
+
+
+def test_subdirectory(checkout):
+  src = str(checkout / 'src')
+  root, paths = arbo_sources.fossil_checkout_paths(src)
+  assert root == src
+  assert sorted(paths) == ['lib/util.c', 'main.c']
+  assert arbo_sources.fossil_checkout_paths(str(checkout / 'src' / 'lib')) \
+      == (str(checkout / 'src' / 'lib'), ['util.c'])
+
+
+def test_not_a_checkout(tmp_path):
+  with pytest.raises(arbo_sources.Unsupported):
+    arbo_sources.fossil_checkout_paths(str(tmp_path))
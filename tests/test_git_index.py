@@ -0,0 +1,127 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo_sources
+
+pytestmark = pytest.mark.skipif(
+    shutil.which('git') is None, reason='git is not installed')
+
+# Long shared prefixes exercise the v4 path compression
+PATHS = [
+    'Makefile', 'Makefile.am', 'a.b', 'a/x', 'lib/long/directory/name/a.c',
+    'lib/long/directory/name/b.c', 'lib/long/other/c.c', 'run.sh',
+    u'unicode/é']
+
+
+def git(repo, *args):
+  return subprocess.check_output(
+      ('git', '-C', str(repo), '-c', 'user.name=t', '-c', 'user.email=t@t')
+      + args)
+
+
+def make_repo(path, *init_args):
+  git(path.parent, 'init', '-q', *(init_args + (str(path), )))
+  for name in PATHS:
+    full = path / name
+    full.parent.mkdir(parents=True, exist_ok=True)
+    full.write_text(name)
+  (path / 'run.sh').chmod(0o755)
+  os.symlink('a.b', str(path / 'link'))
+  git(path, 'add', '.')
+  return path
+
+
+def ls_files(repo):
+  """
+  What git_index_paths should return, from git ls-files --stage.
+  """
+
+  entries = []
+  for entry in git(repo, 'ls-files', '-z', '--stage').split(b'\0')[:-1]:
+    info, path = entry.split(b'\t', 1)
+    path = os.fsdecode(path)
+    if not entries or entries[-1][0] != path:
+      entries.append((path, int(info.split()[0], 8)))
+  return entries
+
+
+def index_paths(repo, start=None):
+  return arbo_sources.git_index_paths(str(repo), str(start or repo))
+
+
+@pytest.mark.parametrize('version', [2, 3, 4])
+def test_index_versions(tmp_path, version):
+  repo = make_repo(tmp_path / 'repo')
+  git(repo, 'update-index', '--index-version', str(version))
+  if version > 2:
+    # Intent-to-add sets an extended flag, which git writes as version 3
+    (repo / 'new').write_text('')
+    git(repo, 'add', '-N', 'new')
+  with open(str(repo / '.git' / 'index'), 'rb') as index:
+    assert index.read(8) == b'DIRC' + version.to_bytes(4, 'big')
+  assert index_paths(repo) == ls_files(repo)
+  assert index_paths(repo, repo / 'lib') == [
+      ('long/directory/name/a.c', 0o100644),
+      ('long/directory/name/b.c', 0o100644),
+      ('long/other/c.c', 0o100644)]
+
+
+def test_sha256(tmp_path):
+  try:
+    repo = make_repo(tmp_path / 'repo', '--object-format=sha256')
+  except subprocess.CalledProcessError:
+    pytest.skip('git without sha256 support')
+  assert index_paths(repo) == ls_files(repo)
+
+
+def test_unmerged(tmp_path):
+  repo = make_repo(tmp_path / 'repo')
+  git(repo, 'commit', '-qm', 'base')
+  git(repo, 'checkout', '-qb', 'other')
+  (repo / 'a.b').write_text('other')
+  git(repo, 'commit', '-qam', 'other')
+  git(repo, 'checkout', '-q', '-')
+  (repo / 'a.b').write_text('this')
+  git(repo, 'commit', '-qam', 'this')
+  with pytest.raises(subprocess.CalledProcessError):
+    git(repo, 'merge', '-q', 'other')
+  stages = git(repo, 'ls-files', '--stage', 'a.b').splitlines()
+  assert len(stages) == 3
+  paths = index_paths(repo)
+  assert paths == ls_files(repo)
+  assert [path for path, mode in paths].count('a.b') == 1
+
+
+def test_split_index(tmp_path):
+  repo = make_repo(tmp_path / 'repo')
+  git(repo, 'update-index', '--split-index')
+  with pytest.raises(arbo_sources.UnsupportedIndex):
+    index_paths(repo)
+
+
+def test_long_name(tmp_path):
+  # Too long for the length in the entry flags
+  repo = make_repo(tmp_path / 'repo')
+  name = '/'.join(['d' * 200] * 21)
+  git(repo, 'update-index', '--add', '--cacheinfo',
+      '100644,%s,%s' % ('e69de29bb2d1d6434b8b29ae775ad8c2e48c5391', name))
+  paths = index_paths(repo)
+  assert paths == ls_files(repo)
+  assert (name, 0o100644) in paths
+
+
+def test_unreadable_index(tmp_path):
+  repo = make_repo(tmp_path / 'repo')
+  index = repo / '.git' / 'index'
+  index.unlink()
+  index.mkdir()
+  with pytest.raises(arbo_sources.UnsupportedIndex):
+    index_paths(repo)
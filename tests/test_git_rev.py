@@ -0,0 +1,106 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ARBO = os.path.join(ROOT, 'arbo.py')
+sys.path.insert(0, ROOT)
+import arbo
+import arbo_lscolors
+import arbo_sources
+
+pytestmark = pytest.mark.skipif(
+    shutil.which('git') is None, reason='git is not installed')
+
+LS_COLORS = 'di=01;34:ln=01;36:ex=01;32:*.c=35'
+EMPTY_BLOB = 'e69de29bb2d1d6434b8b29ae775ad8c2e48c5391'
+MODES = {
+    'dir/inner.c': 0o100644, 'file': 0o100644, 'link': 0o120000,
+    'run.sh': 0o100755, 'sub': 0o160000}
+
+
+def git(repo, *args):
+  return subprocess.check_output(
+      ('git', '-C', str(repo), '-c', 'user.name=t', '-c', 'user.email=t@t')
+      + args)
+
+
+@pytest.fixture
+def repo(tmp_path):
+  # Committed, then removed from the work tree, which --rev doesn't look at
+  path = tmp_path / 'repo'
+  git(tmp_path, 'init', '-q', str(path))
+  (path / 'dir').mkdir()
+  (path / 'dir' / 'inner.c').write_text('')
+  (path / 'file').write_text('')
+  (path / 'run.sh').write_text('')
+  (path / 'run.sh').chmod(0o755)
+  os.symlink('file', str(path / 'link'))
+  git(path, 'add', '.')
+  # A submodule without its checkout
+  git(path, 'update-index', '--add', '--cacheinfo',
+      '160000,%s,sub' % EMPTY_BLOB)
+  git(path, 'commit', '-qm', 'init')
+  for name in ('dir', 'file', 'run.sh', 'link', ):
+    full = path / name
+    if name == 'dir':
+      shutil.rmtree(str(full))
+    else:
+      full.unlink()
+  return path
+
+
+def colored(ls_colors, name, mode, has_children=False):
+  color = ls_colors.git_mode_color(name, mode, has_children)
+  return (color + name + '\033[0m').encode()
+
+
+def test_tree_lines(repo, monkeypatch):
+  monkeypatch.chdir(repo)
+  paths, modes = arbo.git_tree_lines('HEAD', 'utf-8')
+  assert paths == sorted(MODES)
+  assert modes == MODES
+
+
+def test_mode_colors():
+  ls_colors = arbo_lscolors.LsColors(LS_COLORS)
+  assert colored(ls_colors, 'd', arbo_sources.GIT_MODE_TREE) == \
+      b'\033[01;34md\033[0m'
+  assert colored(ls_colors, 's', arbo_sources.GIT_MODE_GITLINK) == \
+      b'\033[01;34ms\033[0m'
+  assert colored(ls_colors, 'l', arbo_sources.GIT_MODE_SYMLINK) == \
+      b'\033[01;36ml\033[0m'
+  assert colored(ls_colors, 'x', arbo_sources.GIT_MODE_EXECUTABLE) == \
+      b'\033[01;32mx\033[0m'
+  assert colored(ls_colors, 'a.c', 0o100644) == b'\033[35ma.c\033[0m'
+  assert ls_colors.git_mode_color('f', 0o100644, False) is None
+  assert colored(ls_colors, 'p', None, has_children=True) == \
+      b'\033[01;34mp\033[0m'
+
+
+@pytest.mark.parametrize('bare', [False, True])
+def test_rev(tmp_path, repo, bare):
+  if bare:
+    cwd = tmp_path / 'bare.git'
+    git(tmp_path, 'clone', '-q', '--bare', str(repo), str(cwd))
+    args = ('git', )
+  else:
+    cwd = repo
+    args = ('git', '--rev', 'HEAD')
+  env = dict(os.environ, LS_COLORS=LS_COLORS)
+  output = subprocess.check_output((sys.executable, ARBO) + args,
+      cwd=str(cwd), env=env)
+  ls_colors = arbo_lscolors.LsColors(LS_COLORS)
+  assert output.splitlines() == [
+      colored(ls_colors, 'dir', None, has_children=True) + b'/'
+      + colored(ls_colors, 'inner.c', MODES['dir/inner.c']),
+      b'file',
+      colored(ls_colors, 'link', MODES['link']),
+      colored(ls_colors, 'run.sh', MODES['run.sh']),
+      colored(ls_colors, 'sub', MODES['sub'])]
@@ -0,0 +1,112 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo_sources
+
+# Both fixtures are the .hg of a checkout of a, b, e, dir/c and
+# dir/sub/d, after hg cp a dir/copied, hg rm b, hg mv e dir/sub/moved,
+# hg add new and hg forget dir/c. hg-dirstate-previous-data is the
+# dirstate-v2 data file of that checkout before those changes.
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+TRACKED = [
+    b'a', b'dir/copied', b'dir/sub/d', b'dir/sub/moved', b'new']
+
+
+def read_fixture(version, name):
+  with open(os.path.join(FIXTURES, 'hg-dirstate-' + version, name), 'rb') as f:
+    return f.read()
+
+
+def checkout(tmp_path, version):
+  shutil.copytree(
+      os.path.join(FIXTURES, 'hg-dirstate-' + version), str(tmp_path / '.hg'))
+  (tmp_path / 'dir').mkdir()
+  return tmp_path
+
+
+def test_v1():
+  # Copy sources follow the path; b, dir/c and e are removed
+  data = read_fixture('v1', 'dirstate')
+  assert b'dir/copied\0a' in data
+  assert sorted(arbo_sources.read_hg_dirstate_v1(data)) == TRACKED
+
+
+def test_v1_truncated():
+  data = read_fixture('v1', 'dirstate')
+  with pytest.raises(arbo_sources.Unsupported):
+    arbo_sources.read_hg_dirstate_v1(data[:-1])
+
+
+def test_v2():
+  hg_dir = os.path.join(FIXTURES, 'hg-dirstate-v2')
+  docket = read_fixture('v2', 'dirstate')
+  assert sorted(arbo_sources.read_hg_dirstate_v2(hg_dir, docket)) == TRACKED
+
+
+def relocate(data, start, count, offset):
+  """
+  Move a dirstate-v2 tree forward by offset bytes, in place.
+  """
+
+  node = arbo_sources.HG_NODE
+  for pos in range(start, start + count * node.size, node.size):
+    fields = list(node.unpack_from(data, pos))
+    (path_start, path_len, base_start, copy_start, copy_len,
+     children_start, children_count) = fields[:7]
+    relocate(data, children_start, children_count, offset)
+    fields[0] += offset
+    if copy_len:
+      fields[3] += offset
+    if children_count:
+      fields[5] += offset
+    node.pack_into(data, pos, *fields)
+
+
+def test_v2_unreachable(tmp_path):
+  # Appending to a data file leaves the nodes of the previous tree
+  # in front of the new one; here the previous tree had b, dir/c and
+  # e tracked
+  checkout(tmp_path, 'v2')
+  hg_dir = tmp_path / '.hg'
+  docket = bytearray((hg_dir / 'dirstate').read_bytes())
+  (marker, p1, p2, root_start, root_count, data_size,
+   uuid_size) = arbo_sources.HG_DOCKET_HEADER.unpack_from(docket)
+  data_path = hg_dir / ('dirstate.' + docket[-uuid_size:].decode())
+  data = bytearray(data_path.read_bytes())
+  with open(os.path.join(FIXTURES, 'hg-dirstate-previous-data'), 'rb') as f:
+    stale = f.read()
+  relocate(data, root_start, root_count, len(stale))
+  data_path.write_bytes(stale + data)
+  arbo_sources.HG_DOCKET_HEADER.pack_into(
+      docket, 0, marker, p1, p2, root_start + len(stale), root_count,
+      len(stale) + data_size, uuid_size)
+  (hg_dir / 'dirstate').write_bytes(bytes(docket))
+  assert sorted(
+      arbo_sources.read_hg_dirstate_v2(str(hg_dir), bytes(docket))) == TRACKED
+
+
+@pytest.mark.parametrize('version', ['v1', 'v2'])
+def test_paths(tmp_path, version):
+  root = str(checkout(tmp_path, version))
+  found_root, paths = arbo_sources.hg_dirstate_paths(root)
+  assert (found_root, sorted(paths)) == (
+      root, [os.fsdecode(path) for path in TRACKED])
+  found_root, paths = arbo_sources.hg_dirstate_paths(os.path.join(root, 'dir'))
+  assert (found_root, sorted(paths)) == (
+      root, ['dir/copied', 'dir/sub/d', 'dir/sub/moved'])
+
+
+def test_v2_data_file_missing(tmp_path):
+  # As when a concurrent hg write rotates the data file's uuid
+  hg_dir = checkout(tmp_path, 'v2') / '.hg'
+  for data_path in hg_dir.glob('dirstate.*'):
+    data_path.unlink()
+  with pytest.raises(arbo_sources.Unsupported):
+    arbo_sources.hg_dirstate_paths(str(tmp_path))
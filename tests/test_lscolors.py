@@ -0,0 +1,56 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ARBO = os.path.join(ROOT, 'arbo.py')
+
+LS_COLORS = [
+    'di=01;34:ln=01;36:or=40;31;01:ex=01;32',
+    'no=00:fi=00:di=34:ln=target:*.gz=31:*.TAR.GZ=35:tw=30;42:pi=33:ex=32',
+    'rs=0:di=01;34:ln=01;36:mi=05;37;41:or=05;37;41:*README=33',
+]
+
+
+def gnu_ls():
+  try:
+    return b'GNU' in subprocess.check_output(('ls', '--version'))
+  except (OSError, subprocess.CalledProcessError):
+    return False
+
+pytestmark = pytest.mark.skipif(not gnu_ls(), reason='GNU ls is needed')
+
+
+@pytest.fixture(params=['ex', 'extended'])
+def tree(request, tmp_path):
+  path = tmp_path / 'ex'
+  shutil.copytree(os.path.join(ROOT, 'ex'), str(path), symlinks=True)
+  if request.param == 'extended':
+    # Names that depend on the locale, and file types ex/ lacks
+    for name in (b'caf\xc3\xa9', b'sep\xe2\x80\xa8x', b'bad\xff',
+                 b'archive.TAR.gz', b'README'):
+      open(os.path.join(os.fsencode(str(path)), name), 'w').close()
+    os.chmod(os.path.join(os.fsencode(str(path)), b'caf\xc3\xa9'), 0o755)
+    os.symlink('sub dir', str(path / 'dirlink'))
+    os.mkfifo(str(path / 'fifo'))
+    (path / 'tmp').mkdir()
+    (path / 'tmp').chmod(0o1777)
+  return path
+
+
+@pytest.mark.parametrize('ls_colors', LS_COLORS)
+@pytest.mark.parametrize('locale', ['C', 'C.UTF-8'])
+def test_same_as_ls(tree, ls_colors, locale):
+  env = dict(os.environ, LC_ALL=locale, LS_COLORS=ls_colors)
+  outputs = [
+      subprocess.check_output(
+          (sys.executable, ARBO) + args + ('find', ), cwd=str(tree), env=env)
+      for args in ((), ('--run-ls', ))]
+  assert outputs[0] == outputs[1]
+  assert b'\033[' in outputs[0]
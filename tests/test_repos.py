@@ -0,0 +1,96 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ARBO = os.path.join(ROOT, 'arbo.py')
+sys.path.insert(0, ROOT)
+import arbo
+
+pytestmark = pytest.mark.skipif(
+    shutil.which('git') is None, reason='git is not installed')
+
+
+def git(repo, *args):
+  return subprocess.check_output(
+      ('git', '-C', str(repo), '-c', 'user.name=t', '-c', 'user.email=t@t',
+       '-c', 'protocol.file.allow=always') + args,
+      stderr=subprocess.STDOUT)
+
+
+def make_repo(path, *names):
+  git(path.parent, 'init', '-q', str(path))
+  for name in names:
+    full = path / name
+    full.parent.mkdir(parents=True, exist_ok=True)
+    full.write_text(name)
+  git(path, 'add', '.')
+  git(path, 'commit', '-qm', 'init')
+  return path
+
+
+@pytest.fixture
+def checkouts(tmp_path, monkeypatch):
+  # super has lib as a submodule; other is a separate checkout
+  lib = make_repo(tmp_path / 'lib', 'lib.c', 'include/lib.h')
+  sup = make_repo(tmp_path / 'super', 'main.c')
+  git(sup, 'submodule', '-q', 'add', str(lib), 'lib')
+  git(sup, 'commit', '-qm', 'lib')
+  make_repo(tmp_path / 'other', 'README', 'src/other.c')
+  monkeypatch.chdir(tmp_path)
+  return tmp_path
+
+
+def run_arbo(cwd, *args):
+  env = dict(os.environ, LS_COLORS='')
+  return subprocess.run(
+      (sys.executable, ARBO) + args, cwd=str(cwd), env=env,
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def commands():
+  return {'git': (['git', 'ls-files', '-z'], True)}
+
+
+def test_several_checkouts(checkouts):
+  assert arbo.multi_checkout_lines(
+      ['super', 'other/src'], commands(), threads=2, submodules=False) == [
+          'other/src/other.c', 'super/.gitmodules', 'super/lib',
+          'super/main.c']
+
+
+def test_submodules(checkouts):
+  assert arbo.multi_checkout_lines(
+      ['super'], commands(), threads=2, submodules=True) == [
+          'super/.gitmodules', 'super/lib', 'super/lib/include/lib.h',
+          'super/lib/lib.c', 'super/main.c']
+
+
+def test_not_a_checkout(checkouts):
+  with pytest.raises(arbo.NotACheckout):
+    arbo.multi_checkout_lines(
+        [os.path.dirname(str(checkouts))], commands(), threads=2,
+        submodules=False)
+
+
+def test_missing_mount(checkouts):
+  proc = run_arbo(checkouts, 'repos', 'other', 'missing', 'other/missing')
+  assert proc.returncode == 1
+  assert proc.stderr.decode().splitlines() == [
+      'arbo: missing: No such file or directory',
+      'arbo: other/missing: No such file or directory']
+  assert b'README' in proc.stdout
+
+
+def test_ls_files_with_submodules(checkouts):
+  proc = run_arbo(
+      checkouts / 'super', 'git', '--ls-files', '--recurse-submodules')
+  assert proc.returncode == 2
+  assert b'--ls-files can\'t be used with --recurse-submodules' \
+      in proc.stderr
@@ -0,0 +1,66 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo
+
+def stream_values(lines):
+  return [
+      (nt.depth, nt.node.value)
+      for nt in arbo.stream_traversals(iter(lines), skip_dot=False)]
+
+def tree_values(lines):
+  return [
+      (nt.depth, nt.node.value)
+      for nt in arbo.tree_from_line_iter(lines, False).traverse_skip_root()]
+
+def test_prefix_sibling_bytewise():
+  # git ls-files and LANG=C sort order
+  lines = ['Makefile', 'Makefile.am', 'a.b', 'a/x', 'src/a.c']
+  assert stream_values(lines) == tree_values(lines) == [
+      (1, 'Makefile'), (1, 'Makefile.am'), (1, 'a.b'), (1, 'a'), (2, 'x'),
+      (1, 'src'), (2, 'a.c')]
+
+def test_prefix_sibling_sorted():
+  # --sort order
+  lines = ['Makefile', 'Makefile.am', 'a.b', 'a', 'a/x']
+  lines.sort(key=arbo.path_sort_key)
+  assert lines == ['Makefile', 'Makefile.am', 'a', 'a/x', 'a.b']
+  assert stream_values(lines) == tree_values(lines)
+
+def test_directory_after_prefixed_sibling():
+  # find | LANG=C sort lists a twice, around a.b
+  lines = ['a', 'a.b', 'a/x']
+  assert stream_values(lines) == tree_values(lines) == [
+      (1, 'a'), (2, 'x'), (1, 'a.b')]
+
+def test_nested_prefixed_siblings():
+  # As in X11/locale: ja, ja.JIS, ja.JIS/Compose, ja/Compose
+  lines = sorted(
+      ['x', 'x/a', 'x/a.b', 'x/a.b.c', 'x/a.b/y', 'x/a-c', 'x/a/y', 'x/b',
+       'z'],
+      key=lambda line: line.encode())
+  assert stream_values(lines) == tree_values(lines) == [
+      (1, 'x'), (2, 'a'), (3, 'y'), (2, 'a-c'), (2, 'a.b'), (3, 'y'),
+      (2, 'a.b.c'), (2, 'b'), (1, 'z')]
+
+def test_dfs_order():
+  # find lists siblings in directory order
+  lines = ['b', 'b/y', 'b/x', 'a', 'c.d', 'c']
+  assert stream_values(lines) == tree_values(lines)
+
+def test_name_repeated():
+  with pytest.raises(arbo.NotSorted):
+    stream_values(['b/x', 'a', 'b/y'])
+  with pytest.raises(arbo.NotSorted):
+    stream_values(['Makefile.am', 'Makefile', 'Makefile.am'])
+
+def test_outside_dot():
+  lines = ['.', './a', '', './b\nc', 'c']
+  with pytest.raises(arbo.NotUnderDot):
+    list(arbo.stream_traversals(iter(lines), skip_dot=True))
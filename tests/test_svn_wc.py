@@ -0,0 +1,46 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import shutil
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import arbo_sources
+
+# The nodes table of a working copy of a, dir/b, dir/sub/c, dir/moved,
+# dir.old, gone and replaced, after svn rm gone, svn rm dir/moved, svn add
+# dir/added, and replacing replaced (one row per op_depth).
+# excluded, not-present and server-excluded nodes aren't in the working
+# copy; partial is incomplete, which svn still lists.
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'svn-wc.db')
+PATHS = [
+    'a', 'dir', 'dir.old', 'dir/added', 'dir/b', 'dir/sub', 'dir/sub/c',
+    'partial', 'replaced']
+
+
+@pytest.fixture
+def working_copy(tmp_path):
+  (tmp_path / '.svn').mkdir()
+  shutil.copyfile(FIXTURE, str(tmp_path / '.svn' / 'wc.db'))
+  (tmp_path / 'dir' / 'sub').mkdir(parents=True)
+  return tmp_path
+
+
+def test_root(working_copy):
+  assert sorted(arbo_sources.svn_wc_paths(str(working_copy))) == PATHS
+
+
+def test_subdirectory(working_copy):
+  assert sorted(arbo_sources.svn_wc_paths(str(working_copy / 'dir'))) == [
+      'added', 'b', 'sub', 'sub/c']
+  assert sorted(arbo_sources.svn_wc_paths(
+      str(working_copy / 'dir' / 'sub'))) == ['c']
+
+
+def test_no_database(tmp_path):
+  (tmp_path / '.svn').mkdir()
+  with pytest.raises(arbo_sources.Unsupported):
+    arbo_sources.svn_wc_paths(str(tmp_path))
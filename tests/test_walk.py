@@ -0,0 +1,45 @@
+# vim: set fileencoding=utf-8 sw=2 ts=2 et :
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ARBO = os.path.join(ROOT, 'arbo.py')
+
+pytestmark = pytest.mark.skipif(
+    shutil.which('find') is None, reason='find is not installed')
+
+
+@pytest.fixture
+def tree(tmp_path):
+  path = tmp_path / 'tree'
+  for name in ('a/x/f', 'a.b', 'a-c/y', 'sub/deep/g', 'sp ace', u'caf\xe9',
+               'run.sh'):
+    full = path / name
+    full.parent.mkdir(parents=True, exist_ok=True)
+    full.write_text(name)
+  (path / 'run.sh').chmod(0o755)
+  (path / 'empty').mkdir()
+  # Not followed
+  os.symlink('sub', str(path / 'link'))
+  return path
+
+
+@pytest.mark.parametrize('threads', ['1', '4'])
+def test_same_as_find(tree, threads):
+  env = dict(os.environ, LC_ALL='C.UTF-8', LS_COLORS='di=01;34:ln=01;36')
+  find = subprocess.Popen(('find', '.'), cwd=str(tree), stdout=subprocess.PIPE)
+  expected = subprocess.check_output(
+      (sys.executable, ARBO, '--sort', 'stdin', '--skip-dot', '--color'),
+      cwd=str(tree), env=env, stdin=find.stdout)
+  assert find.wait() == 0
+  output = subprocess.check_output(
+      (sys.executable, ARBO, 'walk', '--threads', threads),
+      cwd=str(tree), env=env)
+  assert output == expected
+  assert b'\033[01;36mlink\033[0m\n' in output